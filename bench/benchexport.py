@@ -0,0 +1,204 @@
+#! /usr/bin/env python
+
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# benchexport.py
+#
+# Runs the complete export of AS.py outside of Houdini. The soho, sohog
+# and hou modules are replaced by the stand-ins in standins/ which serve
+# a synthetic scene of grid objects, point lights and materials. Every
+# scene size is exported in a process of its own, the export time, the
+# points per second, the peak memory and the size of the project and the
+# archives are reported. With -w the scene is exported a second time in
+# the same process, the archive and fragment caches are warm then. A
+# third export checks that a dirty sop does not reuse its fragment.
+#
+# The exporter is Python 2 code, run the bench with the Python Houdini
+# uses:
+#
+#   python2 bench/benchexport.py -s 1000,100000
+
+import os, sys, time, json, shutil, optparse, tempfile, subprocess
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+benchdir = os.path.dirname( os.path.abspath( __file__ ) )
+ASdir    = os.path.join( benchdir, '..', 'houdini', 'soho', 'python2.x' )
+ASpath   = os.path.join( ASdir, 'AS.py' )
+
+DefaultSizes = '1000,10000,100000,1000000,10000000'
+
+
+# peak resident set size of this process in bytes
+def peakMemory():
+    if resource is None:
+        return 0
+    peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+def directorySize( path ):
+    size = 0
+    for root, dirs, files in os.walk( path ):
+        for name in files:
+            size += os.path.getsize( os.path.join( root, name ) )
+    return size
+
+
+# one export of the configured scene, AS.py runs as SOHO runs it: the
+# whole script is executed for every render
+def export( hip ):
+    import runpy
+    start = time.time()
+    runpy.run_path( ASpath, run_name='__main__' )
+    elapsed = time.time() - start
+    profile = os.path.join( hip, 'bench.profile.json' )
+    phases = {}
+    if os.path.exists( profile ):
+        report = json.load( open( profile ) )
+        phases = dict( ( phase['name'], phase['seconds'] ) for phase in report['phases'] )
+    return ( elapsed, phases )
+
+
+# the inputs of a sop changed but it did not cook yet, its cached
+# fragment must not be reused: the sop has to cook while it is exported
+def dirtyMisses( current, hip ):
+    sop = current.nodes[ current.objects[0].path + '/grid' ]
+    cooks = sop.cooks
+    sop.dirty = True
+    export( hip )
+    return sop.cooks > cooks
+
+
+def runChild( options ):
+    sys.path.insert( 0, ASdir )
+    sys.path.insert( 0, os.path.join( benchdir, 'standins' ) )
+    import scene
+
+    hip = tempfile.mkdtemp( prefix='benchexport' )
+    try:
+        os.mkdir( os.path.join( hip, 'geo' ) )
+        parms = {
+            'as_archivepath'    : [ 'geo' ],
+            'as_archiveformat'  : [ options.format ],
+            'as_archivethreads' : [ options.threads ],
+            'as_profile'        : [ 1 ],
+            'as_loglevel'       : [ 'warning' ],
+            'soho_precision'    : [ options.precision ],
+            'as_streamchunk'    : [ options.chunk ],
+        }
+        if options.stream >= 0:
+            parms['as_streampoints'] = [ options.stream ]
+        current = scene.configure( hip, points=options.child, objects=options.objects,
+                                   lights=options.lights, materials=options.materials,
+                                   parms=parms )
+        ( cold, phases ) = export( hip )
+        result = {
+            'points'    : current.points,
+            'cold'      : cold,
+            'phases'    : phases,
+            'project'   : os.path.getsize( os.path.join( hip, 'bench.appleseed' ) ),
+            'archives'  : directorySize( os.path.join( hip, 'geo' ) ),
+        }
+        if options.warm:
+            result['warm'] = export( hip )[0]
+            if not dirtyMisses( current, hip ):
+                sys.stderr.write( 'the fragment of a dirty sop was reused\n' )
+                sys.exit( 1 )
+        result['memory'] = peakMemory()
+    finally:
+        shutil.rmtree( hip )
+    sys.stdout.write( json.dumps( result ) + '\n' )
+
+
+def runSize( points, options ):
+    cmd = [ sys.executable, os.path.abspath( __file__ ), '--child', str( points ),
+            '-o', str( options.objects ), '-l', str( options.lights ),
+            '-m', str( options.materials ), '-t', str( options.threads ),
+            '-f', options.format, '-p', str( options.precision ),
+            '-S', str( options.stream ), '-c', str( options.chunk ) ]
+    if options.warm:
+        cmd.append( '-w' )
+    process = subprocess.Popen( cmd, stdout=subprocess.PIPE )
+    output = process.communicate()[0]
+    if process.returncode:
+        return None
+    return json.loads( output.decode( 'utf-8' ).splitlines()[-1] )
+
+
+def main():
+    parser = optparse.OptionParser( "%prog [options]" )
+    parser.add_option( "-s", action="store", type="string", dest="sizes", default=DefaultSizes,
+                       help="Comma separated scene sizes in points." )
+    parser.add_option( "-o", action="store", type="int", dest="objects", default=10,
+                       help="Number of objects the points are divided over." )
+    parser.add_option( "-l", action="store", type="int", dest="lights", default=4,
+                       help="Number of point lights." )
+    parser.add_option( "-m", action="store", type="int", dest="materials", default=4,
+                       help="Number of materials." )
+    parser.add_option( "-t", action="store", type="int", dest="threads", default=0,
+                       help="Archive threads, 0 uses up to two threads." )
+    parser.add_option( "-f", action="store", type="string", dest="format", default='obj',
+                       help="Archive format, obj or binarymesh." )
+    parser.add_option( "-p", action="store", type="int", dest="precision", default=9,
+                       help="Significant digits of the floats, 0 for the shortest round trip." )
+    parser.add_option( "-S", action="store", type="int", dest="stream", default=-1,
+                       help="Stream meshes with more points, 0 streams every mesh." )
+    parser.add_option( "-c", action="store", type="int", dest="chunk", default=65536,
+                       help="Points or primitives per chunk of a streamed mesh." )
+    parser.add_option( "-w", action="store_true", dest="warm", default=False,
+                       help="Export a second time with warm caches." )
+    parser.add_option( "--child", action="store", type="int", dest="child", default=0,
+                       help=optparse.SUPPRESS_HELP )
+    (options, args) = parser.parse_args()
+
+    if options.child:
+        runChild( options )
+        return
+
+    header = "%10s %9s %12s %9s %10s %10s" % ( 'points', 'export', 'points/s', 'memory', 'project', 'archives' )
+    if options.warm:
+        header += " %9s" % 'warm'
+    print( header )
+    failed = False
+    for size in options.sizes.split( ',' ):
+        result = runSize( int( size ), options )
+        if result is None:
+            print( "%10s failed" % size )
+            failed = True
+            continue
+        line = "%10d %8.3fs %12.0f %8.1fM %9.1fM %9.1fM" % (
+            result['points'], result['cold'], result['points'] / result['cold'],
+            result['memory'] / 1048576.0, result['project'] / 1048576.0,
+            result['archives'] / 1048576.0 )
+        if options.warm:
+            line += " %8.3fs" % result['warm']
+        print( line )
+        phases = sorted( result['phases'].items(), key=lambda item: -item[1] )
+        print( "%10s %s" % ( '', '  '.join( "%s %.3fs" % phase for phase in phases[:5] ) ) )
+        sys.stdout.flush()
+    if failed:
+        sys.exit( 1 )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,337 @@
+#! /usr/bin/env python
+
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# benchobj.py
+#
+# Compares the per point OBJ archive writer houseed used to have with
+# the bulk writer in ASarchive. Both write the same synthetic grid, the
+# numbers of both archives are checked to be equal within the six
+# decimals of the old writer. The points per second and the archive
+# size of both writers are reported. The velocity blur displacement of ASvelocity
+# is timed on the same grid. Streamed archives, with and without velocity
+# blur, are checked to be the same as the buffered ones.
+
+import os, sys, time, optparse, tempfile
+
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                                  '..', 'houdini', 'soho', 'python2.x' ) )
+import ASarchive, ASvelocity, ASformat
+
+
+# grid of quads with P, N, uv and optionally v using the SohoGeometry
+# interface: handles are returned by attribute() and read with value()
+# and vertex()
+class GridGeometry( object ):
+    _Handles = {
+        ( 'geo:point',  'P' )               : 0,
+        ( 'geo:point',  'N' )               : 1,
+        ( 'geo:point',  'v' )               : 2,
+        ( 'geo:vertex', 'uv' )              : 3,
+        ( 'geo:prim',   'geo:vertexcount' ) : 4,
+        ( 'geo:vertex', 'geo:pointref' )    : 5,
+    }
+
+    def __init__( self, res, velocity=False ):
+        self.res = res
+        self.velocity = velocity
+        self.Handle = 0
+
+    def globalValue( self, name ):
+        res = self.res
+        if name == 'geo:pointcount':
+            return [ res * res ]
+        if name == 'geo:primcount':
+            return [ ( res - 1 ) * ( res - 1 ) ]
+        if name == 'geo:boundingbox':
+            return [ 0.0, 0.0, 0.0, float( res - 1 ), 0.0, float( res - 1 ) ]
+        return None
+
+    def attribute( self, style, name ):
+        handle = self._Handles.get( ( style, name ), -1 )
+        if handle == 2 and not self.velocity:
+            return -1
+        return handle
+
+    def normal( self ):
+        return 1
+
+    def _corner( self, prim, vtx ):
+        row, col = divmod( prim, self.res - 1 )
+        pt = row * self.res + col
+        return ( pt, pt + 1, pt + self.res + 1, pt + self.res )[ vtx ]
+
+    def value( self, handle, index ):
+        if handle == 0:
+            row, col = divmod( index, self.res )
+            return [ col * 1.0, 0.0, row * 1.0 ]
+        if handle == 1:
+            return [ 0.0, 1.0, 0.0 ]
+        if handle == 2:
+            return [ 0.5, 1.0, -0.25 ]
+        if handle == 4:
+            return [ 4 ]
+        return None
+
+    def vertex( self, handle, prim, vtx ):
+        pt = self._corner( prim, vtx )
+        if handle == 5:
+            return [ pt ]
+        if handle == 3:
+            row, col = divmod( pt, self.res )
+            scale = 1.0 / ( self.res - 1 )
+            return [ col * scale, row * scale, 0.0 ]
+        return None
+
+
+# the writer houseed used before ASarchive, one value() call and one
+# print per point, uv, normal and face through a swapped sys.stdout
+def legacySaveObjArchives( geo, name, time_sample ):
+        print( '#archive created at %s' % time.ctime() )
+        print( '#name: %s' % name )
+        bounds = geo.globalValue( 'geo:boundingbox' )
+        print( "# bounds: %s" % ' '.join( map( str, bounds ) ) )
+        print( "# time sample at: %s" % time_sample )
+        nprims = geo.globalValue( 'geo:primcount' )[0]
+        npts   = geo.globalValue( 'geo:pointcount' )[0]
+
+        print( "\n# %d vertices" % npts )
+        pnt = geo.attribute( 'geo:point', 'P' )
+        v_handle = geo.attribute( 'geo:point', 'v' )
+        if v_handle < 0:
+            for pts in range( npts ):
+                pos = geo.value( pnt, pts )
+                print( "v %f %f %f" % ( pos[0], pos[1], pos[2] ) )
+        else:
+            for pts in range( npts ):
+                pos  = geo.value( pnt, pts )
+                v    = geo.value( v_handle,   pts )
+                print( "v " + "".join( [" %f" % ( pos[i] + v[i] * time_sample ) for i in range( 3 ) ] ) )
+
+        prim_uv = dict()
+        counter = 1
+        uv      = geo.attribute( 'geo:vertex', 'uv' )
+        vtxs    = geo.attribute( 'geo:prim', 'geo:vertexcount')
+        if uv > 0:
+            print ("\n# uv coordinates")
+            for prim in range( nprims ):
+                uvLst = []
+                nv    = geo.value( vtxs, prim)[0]
+                for vtx in range( nv ):
+                    uvCoord = geo.vertex( uv, prim, vtx )
+                    print( "vt %f %f %f" % ( uvCoord[0], uvCoord[1], uvCoord[2] ) )
+                    uvLst.append( counter )
+                    counter += 1
+                uvLst = [uvLst[0]] + uvLst[-1:0:-1]
+                prim_uv[ prim ] = uvLst
+
+        nrml = geo.attribute( 'geo:point', "N" )
+        nstr = "\n# normals"
+        if nrml < 0:
+            nrml = geo.normal()
+            nstr = "\n# soho calculated normals"
+        print( nstr )
+        for pts in range( npts ):
+            pnt_nrml = geo.value( nrml, pts )
+            print( "vn %f %f %f" % ( pnt_nrml[0], pnt_nrml[1], pnt_nrml[2] ) )
+
+        nvts   = geo.attribute( 'geo:prim', 'geo:vertexcount' )
+        pntRef = geo.attribute( 'geo:vertex', 'geo:pointref' )
+        print( "\n# %d faces" % nprims )
+        for prim in range( nprims ):
+            nvtx =  geo.value( nvts, prim )[0]
+            vtxList = []
+            nrmList = []
+            for vtx in range( nvtx ):
+                curpnt = geo.vertex( pntRef, prim, vtx )[0] + 1
+                vtxList.append( curpnt )
+                nrmList.append( curpnt )
+            vtxList = [vtxList[0]] + vtxList[-1:0:-1]
+            nrmList = [nrmList[0]] + nrmList[-1:0:-1]
+            if uv < 0:
+                print( "f" + "".join([" %d//%d " % (vtxList[vtx], nrmList[vtx]) for vtx in range(nvtx)]) )
+            else:
+                print( "f" + "".join( [" %d/%d/%d " % (vtxList[vtx], prim_uv[prim][vtx], nrmList[vtx]) for vtx in range(nvtx)] ) )
+
+
+# the files have to be the same apart from the formatting of the numbers,
+# numbers are compared within the six decimals of the legacy writer
+def sameValues( text, other, tolerance=1e-6 ):
+    lines = text.splitlines()
+    other = other.splitlines()
+    if len( lines ) != len( other ):
+        return False
+    for line, other_line in zip( lines, other ):
+        if line == other_line:
+            continue
+        tokens = line.split()
+        other_tokens = other_line.split()
+        if len( tokens ) != len( other_tokens ):
+            return False
+        for token, other_token in zip( tokens, other_tokens ):
+            if token == other_token:
+                continue
+            try:
+                value, other_value = float( token ), float( other_token )
+            except ValueError:
+                return False
+            if abs( value - other_value ) > tolerance * max( 1.0, abs( value ) ):
+                return False
+    return True
+
+
+def writeLegacy( geo, filepath, time_sample ):
+    save_stdout = sys.stdout
+    with open( filepath, 'w' ) as fp:
+        sys.stdout = fp
+        try:
+            legacySaveObjArchives( geo, 'grid', time_sample )
+        finally:
+            sys.stdout = save_stdout
+
+
+def writeBulk( geo, filepath, time_sample, floats=None ):
+    with ASarchive.openArchive( filepath ) as fp:
+        mesh = ASarchive.fetchMeshBuffer( geo )
+        ASarchive.writeObjArchive( fp, mesh, 'grid', time_sample, floats )
+
+
+def writeBinaryMesh( geo, filepath, time_sample ):
+    with ASarchive.openArchive( filepath, True ) as fp:
+        mesh = ASarchive.fetchMeshBuffer( geo )
+        ASarchive.writeBinaryMeshArchive( fp, mesh, 'grid', time_sample )
+
+
+def writeWelded( geo, filepath, time_sample, floats=None ):
+    with ASarchive.openArchive( filepath ) as fp:
+        mesh = ASarchive.weldMesh( ASarchive.fetchMeshBuffer( geo ) )
+        ASarchive.writeObjArchive( fp, mesh, 'grid', time_sample, floats )
+
+
+# the streamed archive of a mesh has to be the same as the buffered one
+# and get the same key, with velocity blur both are displaced to t
+def writeStreamed( geo, filepath, time_sample, chunk, velocity=None ):
+    stream = ASarchive.GeometryStream( geo, chunk, velocity )
+    with ASarchive.openArchive( filepath ) as fp:
+        ASarchive.streamObjArchive( fp, stream, 'grid', time_sample )
+    return stream.key( [] )
+
+
+def writeBuffered( geo, filepath, time_sample, velocity=None ):
+    mesh = ASarchive.fetchMeshBuffer( geo, velocity is not None )
+    if velocity is not None:
+        mesh = ASvelocity.velocityMeshes( mesh, [ velocity ] )[0]
+    with ASarchive.openArchive( filepath ) as fp:
+        ASarchive.writeObjArchive( fp, mesh, 'grid', time_sample )
+    return ASarchive.meshKey( mesh, [] )
+
+
+def streamMatchesBuffer( tmpdir, res=37, chunk=97, time_sample=0.3 ):
+    streamed = os.path.join( tmpdir, 'streamed.obj' )
+    buffered = os.path.join( tmpdir, 'buffered.obj' )
+    same = True
+    for velocity in ( None, time_sample ):
+        geo = GridGeometry( res, velocity is not None )
+        keys = ( writeStreamed( geo, streamed, time_sample, chunk, velocity ),
+                 writeBuffered( geo, buffered, time_sample, velocity ) )
+        same = same and keys[0] == keys[1] and \
+               open( streamed, 'r' ).read() == open( buffered, 'r' ).read()
+    os.remove( streamed )
+    os.remove( buffered )
+    return same
+
+
+def timeWriter( writer, geo, filepath, time_sample, repeat ):
+    best = None
+    for i in range( repeat ):
+        start = time.time()
+        writer( geo, filepath, time_sample )
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = optparse.OptionParser( "%prog [options]" )
+    parser.add_option( "-r", action="store", type="int", dest="res", default=500,
+                       help="Grid resolution, the grid has res*res points." )
+    parser.add_option( "-n", action="store", type="int", dest="repeat", default=3,
+                       help="Number of runs, the fastest run is reported." )
+    parser.add_option( "-p", action="store", type="int", dest="precision",
+                       default=ASformat.DefaultPrecision,
+                       help="Significant digits of the floats, 0 for the shortest round trip." )
+    (options, args) = parser.parse_args()
+
+    geo = GridGeometry( options.res )
+    floats = ASformat.FloatFormat( options.precision )
+    npts = geo.globalValue( 'geo:pointcount' )[0]
+    tmpdir = tempfile.mkdtemp( prefix='benchobj' )
+    legacy = os.path.join( tmpdir, 'legacy.obj' )
+    bulk   = os.path.join( tmpdir, 'bulk.obj' )
+    binary = os.path.join( tmpdir, 'bulk.binarymesh' )
+    welded = os.path.join( tmpdir, 'welded.obj' )
+
+    # the archive header holds the creation time
+    ctime = time.ctime
+    time.ctime = lambda: 'Thu Jan  1 00:00:00 2015'
+    try:
+        t_legacy = timeWriter( writeLegacy, geo, legacy, 0.25, options.repeat )
+        t_bulk   = timeWriter( lambda geo, filepath, time_sample: writeBulk( geo, filepath, time_sample, floats ),
+                               geo, bulk, 0.25, options.repeat )
+        t_binary = timeWriter( writeBinaryMesh, geo, binary, 0.25, options.repeat )
+        t_welded = timeWriter( lambda geo, filepath, time_sample: writeWelded( geo, filepath, time_sample, floats ),
+                               geo, welded, 0.25, options.repeat )
+        streamed = streamMatchesBuffer( tmpdir )
+    finally:
+        time.ctime = ctime
+
+    mesh = ASarchive.fetchMeshBuffer( GridGeometry( options.res, True ), True )
+    start = time.time()
+    ASvelocity.velocityMeshes( mesh, [ -0.02, 0.02 ] )
+    t_velocity = time.time() - start
+
+    identical = sameValues( open( legacy, 'r' ).read(), open( bulk, 'r' ).read() )
+    legacy_size = os.path.getsize( legacy )
+    size = os.path.getsize( bulk )
+    binary_size = os.path.getsize( binary )
+    welded_size = os.path.getsize( welded )
+    for filepath in ( legacy, bulk, binary, welded ):
+        os.remove( filepath )
+    os.rmdir( tmpdir )
+
+    print( "points:     %d" % npts )
+    print( "precision:  %s" % floats.spec )
+    print( "legacy:     %8.3f s  %12.0f points/s  %.1f MB" % ( t_legacy, npts / t_legacy,
+                                                             legacy_size / 1048576.0 ) )
+    print( "bulk:       %8.3f s  %12.0f points/s  %.1f MB" % ( t_bulk, npts / t_bulk,
+                                                             size / 1048576.0 ) )
+    print( "speedup:    %.2fx" % ( t_legacy / t_bulk ) )
+    print( "binarymesh: %8.3f s  %12.0f points/s  %.1f MB" % ( t_binary, npts / t_binary,
+                                                             binary_size / 1048576.0 ) )
+    print( "welded:     %8.3f s  %12.0f points/s  %.1f MB" % ( t_welded, npts / t_welded,
+                                                             welded_size / 1048576.0 ) )
+    print( "velocity:   %8.3f s  %12.0f points/s  (2 samples, numpy %s)" %
+           ( t_velocity, npts / max( t_velocity, 1e-6 ), ASvelocity.numpy is not None ) )
+    print( "equal:      %s" % identical )
+    print( "streamed:   %s" % streamed )
+    if not ( identical and streamed ):
+        sys.exit( 1 )
+
+
+if __name__ == '__main__':
+    main()
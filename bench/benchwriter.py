@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# benchwriter.py
+#
+# Emits a synthetic scene of objects and object instances with the
+# AsProjectFileWriter of AS.py and with the unbuffered writer houseed
+# used to have. The output of both is checked to hold the same values,
+# the entities per second of both and of the compact mode are reported.
+
+import os, sys, time, optparse, tempfile
+
+ASdir  = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ),
+                       '..', 'houdini', 'soho', 'python2.x' )
+ASpath = os.path.join( ASdir, 'AS.py' )
+
+sys.path.insert( 0, ASdir )
+import ASformat
+from benchobj import sameValues
+
+
+# the writer section of AS.py is independent of Houdini, it ends where
+# the settings section starts
+def loadWriter():
+    source = open( ASpath ).read()
+    end = source.index( '# APPLESEED SETTINGS' )
+    end = source.rindex( '#####', 0, end )
+    namespace = {}
+    exec( compile( source[ : end ], ASpath, 'exec' ), namespace )
+    return ( namespace['AsProjectFileWriter'], namespace['AsLogger'] )
+
+
+# the writer core houseed used before, one write call for the indent
+# and one for the text, the indent is built for every line
+class LegacyWriter( object):
+    def __init__( self, filename, logger):
+        self._filename = filename
+        self._logger = logger
+        self._proj_dir = os.path.dirname( self._filename)
+        self._indent_level = 0
+        self._file = open( self._filename, "w")
+
+        # write XML version and encoding
+        self._file.write( '<?xml version="1.0" encoding="UTF-8"?>\n')
+
+        self._logger.log_debug( "Created project writer.\n")
+        self._logger.log_debug( "filename = %s\n" % self._filename)
+        self._logger.log_debug( "proj dir = %s\n" % self._proj_dir)
+
+        self._tags_stack = []
+
+    def _write_text( self, txt):
+        self._file.write( txt)
+
+    def _emit_indent( self):
+        self._write_text( " " * self._indent_level * 4)
+
+    def _emit_text( self, txt):
+        self._emit_indent()
+        self._write_text( txt)
+
+    def _indent( self):
+        self._indent_level += 1
+
+    def _unindent( self):
+        if self._indent_level == 0:
+            self._logger.log_error( "Negative indent level requested.\n")
+
+        self._indent_level -= 1
+
+    def _begin_tag( self, name, values = None):
+        self._tags_stack.append( name )
+
+        if values:
+            self._logger.log_debug( 'begin tag %s values = %s\n' % ( name, values))
+            self._emit_text( '<%s %s>\n' % ( name, values))
+        else:
+            self._logger.log_debug( 'begin tag %s\n' % name)
+            self._emit_text( '<%s>\n' % name )
+
+        self._indent()
+
+    def _end_tag( self, name):
+        if len( self._tags_stack) == 0 or self._tags_stack.pop() != name:
+            self._logger.log_error( "Closing tag %s, that was not opened" % name)
+
+        self._unindent()
+        self._emit_text( '</%s>\n' % name)
+        self._logger.log_debug( 'end tag %s\n' % name)
+        self._inside_tag = None
+
+    def close_project_file( self):
+        self._file.close()
+
+    def emit_whiteline( self ):
+        self._write_text( '\n' )
+
+    def emit_parm( self, name, value):
+        self._emit_text( '<parameter name="%s" value="%s" />\n' % (name, value))
+
+    def emit_matrix( self, values = None):
+        self._begin_tag( 'matrix')
+
+        if values == None:
+            self._emit_text( "1.0 0.0 0.0 0.0\n")
+            self._emit_text( "0.0 1.0 0.0 0.0\n")
+            self._emit_text( "0.0 0.0 1.0 0.0\n")
+            self._emit_text( "0.0 0.0 0.0 1.0\n")
+        else:
+            for i in range(4):
+                self._emit_text( "".join( [ "%f " % values[(i * 4) + j] for j in range(4)]))
+                self._emit_text("\n")
+
+        self._end_tag( 'matrix')
+
+    def emit_transform( self, values = None, time = 0):
+        self._begin_tag( 'transform', 'time="%s"' % time)
+        self.emit_matrix( values)
+        self._end_tag( 'transform')
+
+    def emit_assign_material( self, slot, side, material ):
+        self._emit_text( '<assign_material slot="%s" side="%s" material="%s" />\n' % (slot, side, material) )
+
+    def begin_project( self, revision = 7):
+        self._write_text( "\n" )
+        self._begin_tag( 'project', 'format_revision = "%s"' % revision)
+
+    def end_project( self):
+        self._end_tag( 'project')
+
+    def begin_scene( self):
+        self._begin_tag( 'scene')
+
+    def end_scene( self):
+        self._end_tag( 'scene')
+        self.emit_whiteline()
+
+    def begin_assembly( self, name):
+        self._begin_tag( 'assembly', 'name="%s"' % name)
+
+    def end_assembly( self):
+        self._end_tag( 'assembly')
+        self.emit_whiteline()
+
+    def begin_object( self, name):
+        self._begin_tag( 'object', 'name="%s" model="mesh_object"' % name)
+
+    def end_object( self):
+        self._end_tag( 'object')
+        self.emit_whiteline()
+
+    def begin_object_instance( self, name, obj):
+        self._begin_tag( 'object_instance', 'name="%s" object="%s"' % ( name, obj))
+
+    def end_object_instance( self):
+        self._end_tag( 'object_instance')
+        self.emit_whiteline()
+
+
+# half of the entities are objects, the other half their instances
+def emitScene( writer, entities ):
+    writer.begin_project()
+    writer.begin_scene()
+    writer.begin_assembly( 'master' )
+    for index in range( entities // 2 ):
+        name = 'object%d-geo_0' % index
+        writer.begin_object( name )
+        writer.emit_parm( 'filename', 'geo/%s_0.obj' % name )
+        writer.end_object()
+    for index in range( entities // 2 ):
+        name = 'object%d-geo_0' % index
+        writer.begin_object_instance( name + '.inst', name + '.0' )
+        writer.emit_transform( [ 1.0, 0.0, 0.0, index * 0.5,
+                                 0.0, 1.0, 0.0, 0.0,
+                                 0.0, 0.0, 1.0, index * -0.25,
+                                 0.0, 0.0, 0.0, 1.0 ], 0.0 )
+        writer.emit_assign_material( '/mat/plastic', 'front', '/mat/plastic' )
+        writer.emit_assign_material( '/mat/plastic', 'back', '/mat/plastic' )
+        writer.end_object_instance()
+    writer.end_assembly()
+    writer.end_scene()
+    writer.end_project()
+    writer.close_project_file()
+
+
+def timeWriter( create, filepath, entities, repeat ):
+    best = None
+    for i in range( repeat ):
+        start = time.time()
+        emitScene( create( filepath ), entities )
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    parser = optparse.OptionParser( "%prog [options]" )
+    parser.add_option( "-e", action="store", type="int", dest="entities", default=100000,
+                       help="Number of entities in the scene." )
+    parser.add_option( "-n", action="store", type="int", dest="repeat", default=3,
+                       help="Number of runs, the fastest run is reported." )
+    parser.add_option( "-p", action="store", type="int", dest="precision",
+                       default=ASformat.DefaultPrecision,
+                       help="Significant digits of the floats, 0 for the shortest round trip." )
+    (options, args) = parser.parse_args()
+
+    (AsProjectFileWriter, AsLogger) = loadWriter()
+    logger = AsLogger( False )
+    floats = ASformat.FloatFormat( options.precision )
+    tmpdir  = tempfile.mkdtemp( prefix='benchwriter' )
+    legacy  = os.path.join( tmpdir, 'legacy.appleseed' )
+    current = os.path.join( tmpdir, 'current.appleseed' )
+    compact = os.path.join( tmpdir, 'compact.appleseed' )
+
+    entities = options.entities
+    t_legacy  = timeWriter( lambda path: LegacyWriter( path, logger ), legacy, entities, options.repeat )
+    t_current = timeWriter( lambda path: AsProjectFileWriter( path, logger, False, None, floats ),
+                            current, entities, options.repeat )
+    t_compact = timeWriter( lambda path: AsProjectFileWriter( path, logger, True, None, floats ),
+                            compact, entities, options.repeat )
+
+    identical = sameValues( open( legacy, 'r' ).read(), open( current, 'r' ).read() )
+    legacy_size = os.path.getsize( legacy )
+    size = os.path.getsize( current )
+    compact_size = os.path.getsize( compact )
+    for filepath in ( legacy, current, compact ):
+        os.remove( filepath )
+    os.rmdir( tmpdir )
+
+    print( "entities:   %d" % entities )
+    print( "project:    %.1f MB, %.1f MB legacy" % ( size / 1048576.0, legacy_size / 1048576.0 ) )
+    print( "legacy:     %8.3f s  %12.0f entities/s" % ( t_legacy, entities / t_legacy ) )
+    print( "buffered:   %8.3f s  %12.0f entities/s" % ( t_current, entities / t_current ) )
+    print( "speedup:    %.2fx" % ( t_legacy / t_current ) )
+    print( "compact:    %8.3f s  %12.0f entities/s  %.1f MB" % ( t_compact, entities / t_compact,
+                                                               compact_size / 1048576.0 ) )
+    print( "equal:      %s" % identical )
+    if not identical:
+        sys.exit( 1 )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# hou.py
+#
+# Stand-in for the hou module with the nodes of scene.py. Nothing is
+# time dependent, a node only cooks again after it was made dirty in
+# scene.py. Packed primitives and loading geometry from disk are not
+# supported.
+
+import posixpath
+
+import scene
+
+
+class attribData( object ):
+    Int    = 'Int'
+    Float  = 'Float'
+    String = 'String'
+
+
+class Node( object ):
+    def __init__( self, node ):
+        self._node = node
+
+    def path( self ):
+        return self._node.path
+
+    def creator( self ):
+        parent = self._node.parent
+        if parent is not None:
+            return Node( parent )
+        return Node( scene.Node( posixpath.dirname( self._node.path ) ) )
+
+    def node( self, path ):
+        return node( posixpath.join( self._node.path, path ) )
+
+    def isTimeDependent( self ):
+        return False
+
+    def sessionId( self ):
+        return id( self._node )
+
+    def cookCount( self ):
+        return self._node.cooks
+
+    def needsToCook( self, time=0.0 ):
+        return self._node.dirty
+
+    def geometry( self ):
+        return Geometry()
+
+
+def node( path ):
+    found = scene.current().nodes.get( posixpath.normpath( path ) )
+    return found and Node( found )
+
+
+class Matrix4( object ):
+    def __init__( self, values ):
+        self._values = tuple( float( value ) for value in values )
+
+    def transposed( self ):
+        m = self._values
+        return Matrix4( [ m[ c * 4 + r ] for r in range( 4 ) for c in range( 4 ) ] )
+
+    def asTuple( self ):
+        return self._values
+
+
+# the scene has no packed primitives, other queries are not supported
+class Geometry( object ):
+    def containsPrimType( self, name ):
+        return False
+
+    def loadFromFile( self, path ):
+        raise NotImplementedError( 'hou.Geometry.loadFromFile() is not supported by the stand-in' )
+
+
+def timeToFrame( time ):
+    return time * 24.0 + 1
+
+
+def findFile( name ):
+    raise OSError( name )
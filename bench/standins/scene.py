@@ -0,0 +1,169 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# scene.py
+#
+# Synthetic scene shared by the soho, sohog and hou stand-ins: a camera,
+# point lights, materials and grid objects. The parameters of every
+# object are plain lists of values keyed on the parameter name, what is
+# not set here gets the default of the caller, as in SOHO.
+
+import math
+
+
+# grid of quads in the xz plane with P, N and uv. With two materials
+# every other primitive carries the second one in a shop_materialpath
+# primitive attribute.
+class GridMesh( object ):
+    def __init__( self, res, offset, materials ):
+        self.res       = res
+        self.offset    = offset
+        self.materials = materials
+
+    def pointCount( self ):
+        return self.res * self.res
+
+    def primCount( self ):
+        return ( self.res - 1 ) * ( self.res - 1 )
+
+    def bounds( self ):
+        return [ self.offset, 0.0, 0.0, self.offset + self.res - 1.0, 0.0, self.res - 1.0 ]
+
+    def point( self, index ):
+        row, col = divmod( index, self.res )
+        return [ self.offset + col, 0.0, float( row ) ]
+
+    def corner( self, prim, vtx ):
+        row, col = divmod( prim, self.res - 1 )
+        pt = row * self.res + col
+        return ( pt, pt + 1, pt + self.res + 1, pt + self.res )[ vtx ]
+
+    def uv( self, pt ):
+        row, col = divmod( pt, self.res )
+        scale = 1.0 / ( self.res - 1 )
+        return [ col * scale, row * scale, 0.0 ]
+
+    def material( self, prim ):
+        return self.materials[ prim % len( self.materials ) ]
+
+
+# a node of the scene, parms are found on the node and on the nodes
+# it was created by, like ROP parameters on the output driver
+class Node( object ):
+    def __init__( self, path, parms=None, parent=None, mesh=None ):
+        self.path   = path
+        self.parms  = parms or {}
+        self.parent = parent
+        self.mesh   = mesh
+        self.cooks  = 1
+        self.dirty  = False
+
+    # a dirty node cooks again when its geometry is fetched
+    def cook( self ):
+        if self.dirty:
+            self.cooks += 1
+            self.dirty = False
+
+    def parm( self, name ):
+        return self.parms.get( name )
+
+
+def _translate( x, y, z ):
+    return [ 1.0, 0.0, 0.0, 0.0,
+             0.0, 1.0, 0.0, 0.0,
+             0.0, 0.0, 1.0, 0.0,
+             x,   y,   z,   1.0 ]
+
+
+_Shader = '"plastic" Kd float %g,Cs color %g %g %g,roughness float 0.1 ,'
+
+
+class Scene( object ):
+    def __init__( self, hip, points=100000, objects=10, lights=4, materials=4, parms=None ):
+        self.hip   = hip
+        self.nodes = {}
+        objects   = max( 1, min( objects, points // 4 ) )
+        materials = max( 1, materials )
+        res = max( 2, int( round( math.sqrt( float( points ) / objects ) ) ) )
+        self.points = res * res * objects
+
+        rop_parms = {
+            'object:name'   : [ 'appleseed1' ],
+            '$HIP'          : [ hip ],
+            '$HIPNAME'      : [ 'bench.hip' ],
+            'state:fps'     : [ 24.0 ],
+            'state:time'    : [ 0.0 ],
+            'camera'        : [ '/obj/cam1' ],
+            'soho_diskfile' : [ hip + '/bench.appleseed' ],
+        }
+        rop_parms.update( parms or {} )
+        self.rop = self.addNode( '/out/appleseed1', rop_parms )
+
+        for index in range( materials ):
+            shader = _Shader % ( 0.8, index % 2, ( index // 2 ) % 2, 0.5 )
+            self.addNode( '/shop/mat%d' % index, { 'shop_surfacepath' : [ shader ] } )
+        shops = sorted( path for path in self.nodes if path.startswith( '/shop/' ) )
+
+        self.camera = self.addNode( '/obj/cam1', {
+            'space:world' : _translate( 0.0, 10.0, 20.0 ),
+            'res'         : [ 640, 480 ],
+        } )
+
+        self.lights = []
+        for index in range( lights ):
+            self.lights.append( self.addNode( '/obj/light%d' % index, {
+                'space:world'     : _translate( index * 5.0, 10.0, 0.0 ),
+                'light_type'      : [ 'point' ],
+                'light_intensity' : [ 1.0 ],
+            } ) )
+
+        # odd objects have their material on the object, even objects
+        # two materials on the primitives
+        self.objects = []
+        for index in range( objects ):
+            path = '/obj/geo%d' % index
+            parms = {
+                'object:soppath' : [ path + '/grid' ],
+                'space:world'    : _translate( 0.0, 0.0, index * float( res ) ),
+            }
+            if index % 2 or len( shops ) < 2:
+                parms[ 'shop_materialpath' ] = [ shops[ index % len( shops ) ] ]
+                prim_materials = None
+            else:
+                prim_materials = [ shops[ index % len( shops ) ], shops[ ( index + 1 ) % len( shops ) ] ]
+            obj = self.addNode( path, parms )
+            self.objects.append( obj )
+            self.addNode( path + '/grid', {}, obj, GridMesh( res, 0.0, prim_materials ) )
+
+    def addNode( self, path, parms, parent=None, mesh=None ):
+        node = Node( path, parms, parent, mesh )
+        self.nodes[ path ] = node
+        return node
+
+
+theScene = None
+
+
+def configure( hip, **options ):
+    global theScene
+    theScene = Scene( hip, **options )
+    return theScene
+
+
+def current():
+    if theScene is None:
+        raise RuntimeError( 'scene.configure() has to be called first' )
+    return theScene
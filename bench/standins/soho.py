@@ -0,0 +1,178 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# soho.py
+#
+# Stand-in for the SOHO module of Houdini with the part of the API the
+# exporter uses, evaluated on the synthetic scene of scene.py.
+
+import copy, sys
+
+import scene
+
+
+Precision = 9
+
+LightWranglers  = {}
+CameraWranglers = {}
+ObjectWranglers = {}
+
+_Units = { 'm' : 1.0, 'cm' : 0.01, 'mm' : 0.001, 'in' : 0.0254, 'ft' : 0.3048 }
+
+
+class SohoParm( object ):
+    def __init__( self, houdini, type, default=None, skipdefault=True, key=None ):
+        self.Houdini     = houdini
+        self.Type        = type
+        self.Default     = default
+        self.SkipDefault = skipdefault
+        self.Key         = key or houdini
+        self.Value       = None
+
+
+class SohoObject( object ):
+    def __init__( self, node ):
+        self._node = node
+
+    def _lookup( self, name ):
+        node = self._node
+        while node is not None:
+            value = node.parm( name )
+            if value is not None:
+                return list( value )
+            node = node.parent
+        return None
+
+    def _defaulted( self, name, default ):
+        value = self._lookup( name )
+        if value is None:
+            return default
+        return value
+
+    def getName( self ):
+        return self._node.path
+
+    def evaluate( self, parms, now ):
+        if isinstance( parms, dict ):
+            result = {}
+            for parm in parms.values():
+                value = self._lookup( parm.Houdini )
+                if value is None:
+                    if parm.SkipDefault or parm.Default is None:
+                        continue
+                    value = parm.Default
+                parm = copy.copy( parm )
+                parm.Value = value
+                result[ parm.Key ] = parm
+            return result
+        result = []
+        for parm in parms:
+            parm = copy.copy( parm )
+            parm.Value = self._defaulted( parm.Houdini, parm.Default )
+            result.append( parm )
+        return result
+
+    def evalString( self, name, now, value ):
+        found = self._lookup( name )
+        if found is None:
+            return False
+        value.extend( found )
+        return True
+
+    evalFloat = evalString
+    evalInt   = evalString
+
+    def getDefaultedString( self, name, now, default ):
+        return self._defaulted( name, default )
+
+    getDefaultedInt    = getDefaultedString
+    getDefaultedFloat  = getDefaultedString
+    getDefaultedShader = getDefaultedString
+
+    def wrangleString( self, wrangler, name, now, default ):
+        return self._defaulted( name, default )
+
+    wrangleInt    = wrangleString
+    wrangleFloat  = wrangleString
+    wrangleShader = wrangleString
+
+    def getCameraCropWindow( self, wrangler, now ):
+        return [ 0.0, 1.0, 0.0, 1.0 ]
+
+
+def _rop():
+    return SohoObject( scene.current().rop )
+
+
+def getOutputDriver():
+    return _rop()
+
+
+def getObject( path ):
+    node = scene.current().nodes.get( path )
+    return node and SohoObject( node )
+
+
+def evaluate( parms, now=0 ):
+    return _rop().evaluate( parms, now )
+
+
+def getDefaultedString( name, default ):
+    return _rop().getDefaultedString( name, 0, default )
+
+
+getDefaultedInt   = getDefaultedString
+getDefaultedFloat = getDefaultedString
+
+
+def initialize( now, camera ):
+    return camera in scene.current().nodes
+
+
+# every object and light of the scene is selected
+def addObjects( now, objects, lights, fog, display, **parms ):
+    pass
+
+
+def removeObjects( now, objects, lights, fog, **parms ):
+    pass
+
+
+def lockObjects( now ):
+    pass
+
+
+def objectList( name ):
+    current = scene.current()
+    if name == 'objlist:camera':
+        return [ SohoObject( current.camera ) ]
+    if name == 'objlist:instance':
+        return [ SohoObject( node ) for node in current.objects ]
+    if name == 'objlist:light':
+        return [ SohoObject( node ) for node in current.lights ]
+    return []
+
+
+def houdiniUnitLength( value, unit ):
+    return value * _Units.get( unit, 1.0 )
+
+
+def warning( message ):
+    sys.stderr.write( 'soho warning: %s\n' % message )
+
+
+def error( message ):
+    raise RuntimeError( message )
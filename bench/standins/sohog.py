@@ -0,0 +1,116 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+# sohog.py
+#
+# Stand-in for SohoGeometry on the grid meshes of scene.py. Handles are
+# returned by attribute() and read with value() and vertex(), a
+# partition holds a subset of the primitives and all points.
+
+import scene
+
+
+_Handles = {
+    ( 'geo:point',  'P' )                  : 0,
+    ( 'geo:point',  'N' )                  : 1,
+    ( 'geo:vertex', 'uv' )                 : 3,
+    ( 'geo:prim',   'geo:vertexcount' )    : 4,
+    ( 'geo:vertex', 'geo:pointref' )       : 5,
+    ( 'geo:prim',   'intrinsic:typename' ) : 6,
+    ( 'geo:prim',   'geo:primclose' )      : 7,
+    ( 'geo:prim',   'shop_materialpath' )  : 8,
+}
+
+_Normal = [ 0.0, 1.0, 0.0 ]
+
+
+class SohoGeometry( object ):
+    def __init__( self, path, time=0.0, mesh=None, prims=None ):
+        if mesh is None:
+            node = scene.current().nodes.get( path )
+            mesh = node and node.mesh
+            if mesh is not None:
+                node.cook()
+        self._mesh  = mesh
+        self._prims = prims
+        self.Handle = -1
+        if mesh is not None:
+            self.Handle = 0
+
+    def _prim( self, index ):
+        if self._prims is None:
+            return index
+        return self._prims[ index ]
+
+    def globalValue( self, name ):
+        mesh = self._mesh
+        if name == 'geo:pointcount':
+            return [ mesh.pointCount() ]
+        if name == 'geo:primcount':
+            if self._prims is None:
+                return [ mesh.primCount() ]
+            return [ len( self._prims ) ]
+        if name == 'geo:boundingbox':
+            return mesh.bounds()
+        return None
+
+    def attribute( self, style, name ):
+        handle = _Handles.get( ( style, name ), -1 )
+        if handle == 8 and not self._mesh.materials:
+            return -1
+        return handle
+
+    def attribProperty( self, handle, name ):
+        if name == 'geo:vectorsize':
+            return [ 3 ]
+        return None
+
+    def normal( self ):
+        return 1
+
+    def value( self, handle, index ):
+        if handle == 0:
+            return self._mesh.point( index )
+        if handle == 1:
+            return _Normal
+        if handle == 4:
+            return [ 4 ]
+        if handle == 6:
+            return [ 'Poly' ]
+        if handle == 7:
+            return [ 1 ]
+        if handle == 8:
+            return [ self._mesh.material( self._prim( index ) ) ]
+        return None
+
+    def vertex( self, handle, prim, vtx ):
+        pt = self._mesh.corner( self._prim( prim ), vtx )
+        if handle == 5:
+            return [ pt ]
+        if handle == 3:
+            return self._mesh.uv( pt )
+        return None
+
+    def partition( self, style, attrib ):
+        mesh = self._mesh
+        if style != 'geo:partattrib' or attrib != 'shop_materialpath' or not mesh.materials:
+            return { '' : self }
+        parts = {}
+        for index in range( self.globalValue( 'geo:primcount' )[0] ):
+            prim = self._prim( index )
+            parts.setdefault( mesh.material( prim ), [] ).append( prim )
+        return dict( ( material, SohoGeometry( None, mesh=mesh, prims=prims ) )
+                     for material, prims in parts.items() )
@@ -12,7 +12,7 @@
 #        output keyword
 #        closure keyword?
 
-import sys, os, optparse
+import sys, os, re, time, json, optparse, subprocess, multiprocessing
 import oslparser, oslds
 
 #----------------------------------------------------------
@@ -34,6 +34,22 @@ def checkFiles( args ):
             error( "File does not exist: %s" % shaderfile, True )
 
 
+def replaceQuotes( st ):
+    return st.replace( '\\"', '"' )
+
+
+# the type of an array parameter without its size, "float[3]" is
+# returned as ( "float", 3 ). The size is 0 for other parameters.
+def splitArrayType( oslType ):
+    obracket = oslType.find( '[' )
+    if obracket < 0:
+        return( oslType, 0 )
+    size = oslType[obracket+1: oslType.find( ']' )]
+    if size.isdigit():
+        return( oslType[:obracket], int(size) )
+    return( oslType[:obracket], 0 )
+
+
 def queryValues( oslType, st ):
     if oslType == "string":
         return(st, 1)
@@ -80,21 +96,25 @@ def createDS( shader ):
     parmnames = shader['parmlist']
     for name in parmnames:
         parm = shader[name]
+        # output parameters are not shown on the shop
+        if parm.get( 'output' ):
+            continue
         # check if a parameter name starts with output
         # get rid of it
         _name = parm["name"].split()
         if len( _name ) > 1:
             print( _name )
         # create houdini ds parm
-        oslParm = oslds.OslParmDS( parm['name'], parm['type'] )
+        (oslType, arraySize) = splitArrayType( parm['type'] )
+        oslParm = oslds.OslParmDS( parm['name'], oslType )
         #set label
         if 'label' in parm:
-            oslParm.setlabel( parm['label'] )
+            oslParm.setLabel( parm['label'] )
         # get and set values and arraysize
         parmvalues = parm['value']
         (values, asize) = queryValues( oslParm.Type, parmvalues )
         oslParm.setDefault( values )
-        oslParm.setArraySize( asize )
+        oslParm.setArraySize( arraySize or asize )
         # set range on parameter
         if 'UImin' in parm:
             range_v = [parm['UImin'], parm['UImax']]
@@ -128,6 +148,295 @@ def createDS( shader ):
     return ds
 
 
+# run by the workers of the pool, shaders that are not in the cache are
+# parsed in parallel
+def parseShader( oso ):
+    return ( oso, oslparser.parseShader( oso ) )
+
+
+def parseShaders( shaderfiles, cache, jobs, verbose ):
+    shaders = dict()
+    missing = list()
+    for oso in shaderfiles:
+        shader = None
+        if cache is not None:
+            shader = cache.lookup( oso )
+        if shader:
+            shaders[oso] = shader
+        else:
+            missing.append( oso )
+
+    if jobs != 1 and len( missing ) > 1:
+        pool = multiprocessing.Pool( jobs or None )
+        try:
+            parsed = pool.map( parseShader, missing )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        parsed = [ parseShader( oso ) for oso in missing ]
+
+    for (oso, shader) in parsed:
+        if not shader:
+            continue
+        shaders[oso] = shader
+        if cache is not None:
+            cache.store( oso, shader )
+    if cache is not None:
+        cache.save()
+        if verbose:
+            print("Shader cache: %d hits, %d misses" % (cache.hits, cache.misses))
+    return shaders
+
+
+# the files named by the #include directives of a shader source
+_includeDirective = re.compile( r'^\s*#\s*include\s*[<"]([^>"]+)[>"]', re.M )
+
+
+# included files found next to the including file or in the include
+# paths, files that are not found are left to oslc. memo keeps the
+# includes of every file that has been read.
+def directIncludes( source, includePaths, memo ):
+    if source in memo:
+        return memo[source]
+    includes = list()
+    try:
+        with open( source, 'r' ) as fp:
+            names = _includeDirective.findall( fp.read() )
+    except ( IOError, OSError ):
+        names = list()
+    directories = [ os.path.dirname( source ) ] + includePaths
+    for name in names:
+        for directory in directories:
+            include = os.path.abspath( os.path.join( directory, name ) )
+            if os.path.isfile( include ):
+                includes.append( include )
+                break
+    memo[source] = includes
+    return includes
+
+
+# all files a shader source depends on, the includes of includes too
+def dependencies( source, includePaths, memo ):
+    found = set()
+    stack = [ os.path.abspath( source ) ]
+    while stack:
+        for include in directIncludes( stack.pop(), includePaths, memo ):
+            if include not in found:
+                found.add( include )
+                stack.append( include )
+    return found
+
+
+# like make a compiled shader is stale when it is older than its source
+# or any of the files the source includes
+def isStale( source, oso, includePaths, memo ):
+    if not os.path.exists( oso ):
+        return True
+    built = os.path.getmtime( oso )
+    for path in [ source ] + list( dependencies( source, includePaths, memo ) ):
+        if os.path.getmtime( path ) > built:
+            return True
+    return False
+
+
+# run by the workers of the pool
+def compileShader( job ):
+    (source, oso, includePaths) = job
+    cmd = [ 'oslc', '-o', oso ] + [ '-I%s' % path for path in includePaths ] + [ source ]
+    try:
+        process = subprocess.Popen( cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT )
+    except OSError as e:
+        return ( source, False, str( e ) )
+    output = process.communicate()[0]
+    return ( source, process.returncode == 0, output.decode( 'utf-8', 'replace' ) )
+
+
+# the decoded compiler output in the encoding of stdout, a pipe gets
+# utf-8. Characters the encoding does not have are replaced.
+def writeOutput( output ):
+    encoding = getattr( sys.stdout, 'encoding', None ) or 'utf-8'
+    output = output.encode( encoding, 'replace' )
+    if sys.version_info[0] >= 3:
+        output = output.decode( encoding )
+    sys.stdout.write( output )
+
+
+# compiles the stale shader sources with oslc on a process pool, the
+# .oso files are written next to their source. Returns the compiled
+# shaders of the sources which compiled or were up to date.
+def compileShaders( sources, includePaths, jobs, verbose ):
+    memo  = dict()
+    stale = list()
+    compiled = list()
+    for source in sources:
+        oso = os.path.splitext( source )[0] + '.oso'
+        compiled.append( ( source, oso ) )
+        if isStale( source, oso, includePaths, memo ):
+            stale.append( ( source, oso, includePaths ) )
+        elif verbose:
+            print("Up to date: %s" % oso)
+
+    if jobs != 1 and len( stale ) > 1:
+        pool = multiprocessing.Pool( jobs or None )
+        try:
+            results = pool.map( compileShader, stale )
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [ compileShader( job ) for job in stale ]
+
+    failed = set()
+    for (source, status, output) in results:
+        if verbose and status:
+            print("Compiled: %s" % source)
+        if output.strip():
+            writeOutput( output )
+        if not status:
+            failed.add( source )
+            error( "Could not compile shader %s." % source )
+    return [ oso for (source, oso) in compiled if source not in failed ]
+
+
+# all shaders are written to one expanded library which is compiled
+# by a single hotl run
+def writeLibrary( shaderfiles, shaders, hdaFile, otlFile, verbose,
+                  label=None, icon=None, name=None, path=None ):
+    library = oslds.OslLibraryDS()
+    try:
+        for oso in shaderfiles:
+            if oso not in shaders:
+                continue
+            if verbose:
+                print("Processing: %s" % oso)
+            # create ds object
+            ds = createDS( shaders[oso] )
+            ds.setIcon( icon )
+            ds.setName( name )
+            ds.setPath( path )
+            ds.setLabel( label )
+            library.addShader( ds )
+        if hdaFile:
+            return library.compile( hdaFile )
+        return library.merge( otlFile )
+    finally:
+        library.cleanup()
+
+
+# keeps an otl in sync with the .oso files in a directory. The directory
+# is polled, a changed file is processed once it has not changed for the
+# debounce time, so the files of an oslc rebuild are merged together. The
+# manifest next to the otl records the merged files, after a restart only
+# shaders changed in the meantime are processed again.
+class ShaderWatch( object ):
+    def __init__( self, directory, otlfile, cache, jobs, verbose ):
+        self.directory = directory
+        self.otlfile   = otlfile
+        self.manifest  = otlfile + '.manifest'
+        self.cache     = cache
+        self.jobs      = jobs
+        self.verbose   = verbose
+        self.entries   = self._readManifest()
+        self.pending   = dict()
+
+    def _readManifest( self ):
+        try:
+            with open( self.manifest, 'r' ) as fp:
+                return json.load( fp )
+        except ( IOError, OSError, ValueError ):
+            return dict()
+
+    def _saveManifest( self ):
+        tmppath = self.manifest + '.tmp'
+        with open( tmppath, 'w' ) as fp:
+            json.dump( self.entries, fp, indent=0, sort_keys=True )
+        if os.name == 'nt' and os.path.exists( self.manifest ):
+            os.remove( self.manifest )
+        os.rename( tmppath, self.manifest )
+
+    def _shaderFiles( self ):
+        files = dict()
+        for root, dirs, names in os.walk( self.directory ):
+            for filename in names:
+                if not filename.endswith( '.oso' ):
+                    continue
+                oso = os.path.abspath( os.path.join( root, filename ) )
+                try:
+                    st = os.stat( oso )
+                except OSError:
+                    continue
+                files[oso] = [ st.st_mtime, st.st_size ]
+        return files
+
+    # the files that changed and have been stable for debounce seconds
+    def scan( self, debounce ):
+        now   = time.time()
+        files = self._shaderFiles()
+        ready = list()
+        for oso in files:
+            entry = self.entries.get( oso )
+            if entry and [ entry['mtime'], entry['size'] ] == files[oso]:
+                self.pending.pop( oso, None )
+                continue
+            pending = self.pending.get( oso )
+            if pending is None or pending[0] != files[oso]:
+                self.pending[oso] = ( files[oso], now )
+            elif now - pending[1] >= debounce:
+                ready.append( oso )
+        # removed shaders stay in the otl but are no longer watched
+        removed = [ oso for oso in self.entries if oso not in files ]
+        for oso in removed:
+            del self.entries[oso]
+            if self.verbose:
+                print("Removed: %s" % oso)
+        if removed and not ready:
+            self._saveManifest()
+        return sorted( ready )
+
+    # merge the changed shaders, files touched without changing their
+    # content only update the manifest. Shaders that do not parse are
+    # recorded as well so they are only tried again once they change,
+    # files removed since the scan are dropped.
+    def update( self, ready ):
+        changed = list()
+        entries = dict()
+        for oso in ready:
+            del self.pending[oso]
+            try:
+                st = os.stat( oso )
+                digest = oslparser.fileDigest( oso )
+            except ( IOError, OSError ):
+                continue
+            entries[oso] = { 'mtime' : st.st_mtime, 'size' : st.st_size, 'md5' : digest }
+            entry = self.entries.get( oso )
+            if not entry or entry['md5'] != digest:
+                changed.append( oso )
+        shaders = dict()
+        if changed:
+            shaders = parseShaders( changed, self.cache, self.jobs, self.verbose )
+            if shaders and not writeLibrary( changed, shaders, None, self.otlfile, self.verbose ):
+                error( "Could not update the digital asset library." )
+                return False
+        self.entries.update( entries )
+        self._saveManifest()
+        if shaders:
+            print("Updated %d shaders in %s" % (len(shaders), self.otlfile))
+        return True
+
+    def run( self, interval, debounce ):
+        if self.verbose:
+            print("Watching %s" % self.directory)
+        try:
+            while True:
+                ready = self.scan( debounce )
+                if ready:
+                    self.update( ready )
+                time.sleep( interval )
+        except KeyboardInterrupt:
+            pass
+
+
 #----------------------------------------------------------
 # Main body
 #----------------------------------------------------------
@@ -137,48 +446,76 @@ osl2otl converts compiled OSL (openshadinglanguage)
 shaders into a HDA or adds it to an existing OTL.
 """
 
-parser = optparse.OptionParser( usage )
-
-parser.add_option( "-v", action="store_true", dest="verbose", help="Output verbosity." )
-parser.add_option( "-s", action="store_true", dest="source", help="Parse shader source file instead of object file." )
-parser.add_option( "-l", action="store", dest="hdafile", help="Create a Houdini digital asset for a single shader." )
-parser.add_option( "-L", action="store", dest="otlfile", help="Add shader to an existing digital asset library." )
-parser.add_option( "-N", action="store", dest="label", help="For a single .oso file, specify the label in the menu." )
-parser.add_option( "-C", action="store", dest="iconfile", help="For a single .oso file, specify the icon in the menu." )
-parser.add_option( "-n", action="store", dest="shopname", help="For a single .oso file, specify the name in the menu." )
-parser.add_option( "-p", action="store", dest="shoppath", help="For a single .oso file, specify the name in the menu." )
-
-(options, args) = parser.parse_args()
-
-if len( sys.argv[1:] ) == 0:
-    parser.print_help()
-    error( "", True )
-if len( args ) == 0:
-    error( "No shader files specified.", True )
-else:
-    checkFiles(args )
-
-hdaFile = options.hdafile
-otlFile = options.otlfile
-label   = options.label
-icon    = options.iconfile
-name    = options.shopname
-path    = options.shoppath
-verbose = options.verbose
-
-for oso in args:
-    if verbose:
-        print("Processing: %s" % oso)
-    # create ds object
-    shader = oslparser.parseOslInfo( oso )
-    if not shader:
-        continue
-    ds = createDS( shader )
-    ds.setIcon( icon )
-    ds.setName( name )
-    ds.setPath( path )
-    ds.setLabel( label )
-    if hdaFile:
-        ds.makeOTL( hdaFile )
+def main():
+    parser = optparse.OptionParser( usage )
+
+    parser.add_option( "-v", action="store_true", dest="verbose", help="Output verbosity." )
+    parser.add_option( "-s", action="store_true", dest="source",
+                       help="Compile the shader source files with oslc, only sources which are newer than their .oso files or their includes are compiled." )
+    parser.add_option( "-I", action="append", dest="includes", default=[],
+                       help="Include path for the shader sources, may be used more than once." )
+    parser.add_option( "-l", action="store", dest="hdafile", help="Create a Houdini digital asset for a single shader." )
+    parser.add_option( "-L", action="store", dest="otlfile", help="Add shader to an existing digital asset library." )
+    parser.add_option( "-N", action="store", dest="label", help="For a single .oso file, specify the label in the menu." )
+    parser.add_option( "-C", action="store", dest="iconfile", help="For a single .oso file, specify the icon in the menu." )
+    parser.add_option( "-n", action="store", dest="shopname", help="For a single .oso file, specify the name in the menu." )
+    parser.add_option( "-p", action="store", dest="shoppath", help="For a single .oso file, specify the name in the menu." )
+    parser.add_option( "-c", action="store", dest="cachefile", default=oslparser.defaultCacheFile(),
+                       help="Cache file of the parsed shaders, unchanged shaders are not read again." )
+    parser.add_option( "-x", action="store_true", dest="nocache", help="Do not use the cache file." )
+    parser.add_option( "-j", action="store", type="int", dest="jobs", default=0,
+                       help="Number of shaders parsed in parallel, 0 uses a process per cpu." )
+    parser.add_option( "-w", "--watch", action="store", dest="watch",
+                       help="Keep the library of -L in sync with the .oso files in a directory." )
+    parser.add_option( "--interval", action="store", type="float", dest="interval", default=1.0,
+                       help="Seconds between the scans of the watched directory." )
+    parser.add_option( "--debounce", action="store", type="float", dest="debounce", default=0.5,
+                       help="Seconds a changed shader has to stay unchanged before it is merged." )
+
+    (options, args) = parser.parse_args()
+
+    if len( sys.argv[1:] ) == 0:
+        parser.print_help()
+        error( "", True )
+    if options.watch:
+        if options.source:
+            error( "Shader sources are not watched, -s can not be used with --watch.", True )
+        if not options.otlfile:
+            error( "Watching a directory needs a library, use -L.", True )
+        if not os.path.isdir( options.watch ):
+            error( "Directory does not exist: %s" % options.watch, True )
+    elif len( args ) == 0:
+        error( "No shader files specified.", True )
     else:
-        ds.addToOTL( otlFile )
+        checkFiles(args )
+    if not options.hdafile and not options.otlfile:
+        error( "No digital asset file specified, use -l or -L.", True )
+
+    hdaFile = options.hdafile
+    otlFile = options.otlfile
+    label   = options.label
+    icon    = options.iconfile
+    name    = options.shopname
+    path    = options.shoppath
+    verbose = options.verbose
+
+    cache = None
+    if not options.nocache:
+        cache = oslparser.OslInfoCache( options.cachefile )
+
+    if options.source:
+        args = compileShaders( args, options.includes, options.jobs, verbose )
+        if not args:
+            error( "No shaders compiled.", True )
+
+    if options.watch:
+        ShaderWatch( options.watch, otlFile, cache, options.jobs, verbose ).run( options.interval, options.debounce )
+        return
+
+    shaders = parseShaders( args, cache, options.jobs, verbose )
+    if not writeLibrary( args, shaders, hdaFile, otlFile, verbose, label, icon, name, path ):
+        error( "Could not create the digital asset library.", True )
+
+
+if __name__ == '__main__':
+    main()
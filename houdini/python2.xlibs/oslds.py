@@ -15,7 +15,7 @@ Copyright 2014 Hans Hoogenboom
 """
 
 
-import os, sys, tempfile, time
+import os, sys, shutil, tempfile, time
 
 
 _HoudiniShaderMap = {
@@ -248,65 +248,97 @@ class OslShaderDS:
         return True
 
     def makeOTL( self, otl_path ):
-        tmpdir = tempfile.mkdtemp(prefix='oslds')
-
-        # create otl header
-        with open( tmpdir + '/Sections.list', 'w' ) as fp:
-            fp.write( '""\nINDEX__SECTION INDEX_SECTION\nShop_1%s Shop/%s\n' % (self.Name, self.Name) )
-
-        with open( tmpdir + '/INDEX__SECTION', 'w' ) as fp:
-            fp.write( 'Operator: %s\n' % self.Name )
-            fp.write( 'Label: %s\n' % self.Label )
-            fp.write( 'Path: oplib:/Shop/%s?Shop/%s\n' % (self.Name, self.Name) )
-            if self.Icon:
-                fp.write( 'Icon: %s\n' % self.Icon )
-            fp.write( 'Table: Shop\n' )
-            fp.write( 'Extra: %s\n' % self.HType )
-            fp.write( 'Inputs: 0 to 0\n' )
-            fp.write( 'Subnet: false\n' )
-            fp.write( 'Python: false\n' )
-            fp.write( 'Empty: false\n' )
-            now = time.strftime( '%a %b %d %H:%M:%S %Y' )
-            fp.write( 'Modified: %s\n' % now )
-
-        # create content dir
-        contents_dir = tmpdir + ('/Shop_1%s' % self.Name)
+        library = OslLibraryDS()
+        try:
+            if not library.addShader( self ):
+                return False
+            return library.compile( otl_path )
+        finally:
+            library.cleanup()
+
+    def addToOTL(self, otl_path, force=True):
+        library = OslLibraryDS()
+        try:
+            if not library.addShader( self ):
+                return False
+            return library.merge( otl_path, force )
+        finally:
+            library.cleanup()
+
+
+# an expanded operator library in a temporary directory, the dialog
+# scripts of any number of shaders are written to it and hotl compiles
+# them in one go
+class OslLibraryDS:
+    def __init__( self ):
+        self.Path    = tempfile.mkdtemp( prefix='oslds' )
+        self.Shaders = list()
+
+    def addShader( self, ds ):
+        if not ds.HType:
+            return False
+        # a later shader with the same name replaces the earlier one
+        contents_dir = os.path.join( self.Path, 'Shop_1%s' % ds.Name )
+        if os.path.isdir( contents_dir ):
+            shutil.rmtree( contents_dir )
         os.mkdir( contents_dir )
+        self.Shaders = [ shader for shader in self.Shaders if shader.Name != ds.Name ]
+        self.Shaders.append( ds )
 
-        with open( contensts_dir + '/Sections.list', 'w' )
+        with open( contents_dir + '/Sections.list', 'w' ) as fp:
             fp.write( '""\nDialogScript DialogScript\n' )
 
-        with open( contents_dir + '/DialogScript', 'w' )
-            self.saveDialogScript(fp)
-            fp.close()
-
-        # compile and assemble otl
-        cmd = 'hotl -c "%s" "%s"' % ( tmpdir, otl_path )
-        status = os.system(cmd)
-
-        # remove temporary files
-        os.remove( tmpdir + '/INDEX__SECTION' )
-        os.remove( tmpdir + '/Sections.list' )
-        os.remove( contents_dir + '/DialogScript' )
-        os.remove( contents_dir + '/Sections.list' )
-        os.rmdir( contents_dir )
-        os.rmdir( tmpdir )
-
+        with open( contents_dir + '/DialogScript', 'w' ) as fp:
+            ds.saveDialogScript(fp)
         return True
 
-    def addToOTL(self, otl_path, force=True):
-        if not self.HType:
+    # otl header with an index entry for every shader
+    def _writeIndex( self ):
+        with open( self.Path + '/Sections.list', 'w' ) as fp:
+            fp.write( '""\nINDEX__SECTION INDEX_SECTION\n' )
+            for ds in self.Shaders:
+                fp.write( 'Shop_1%s Shop/%s\n' % (ds.Name, ds.Name) )
+
+        now = time.strftime( '%a %b %d %H:%M:%S %Y' )
+        with open( self.Path + '/INDEX__SECTION', 'w' ) as fp:
+            for ds in self.Shaders:
+                fp.write( 'Operator: %s\n' % ds.Name )
+                fp.write( 'Label: %s\n' % ds.Label )
+                fp.write( 'Path: oplib:/Shop/%s?Shop/%s\n' % (ds.Name, ds.Name) )
+                if ds.Icon:
+                    fp.write( 'Icon: %s\n' % ds.Icon )
+                fp.write( 'Table: Shop\n' )
+                fp.write( 'Extra: %s\n' % ds.HType )
+                fp.write( 'Inputs: 0 to 0\n' )
+                fp.write( 'Subnet: false\n' )
+                fp.write( 'Python: false\n' )
+                fp.write( 'Empty: false\n' )
+                fp.write( 'Modified: %s\n\n' % now )
+
+    # compile and assemble otl
+    def compile( self, otl_path ):
+        if not self.Shaders:
             return False
-
+        self._writeIndex()
+        cmd = 'hotl -c "%s" "%s"' % ( self.Path, otl_path )
+        return os.system(cmd) == 0
+
+    # merge the shaders into an existing otl, a new otl is compiled directly
+    def merge( self, otl_path, force=True ):
+        if not os.path.exists( otl_path ):
+            return self.compile( otl_path )
         tmpotl = tempfile.mktemp( prefix='oslds' )
-        self.makeOTL( tmpotl )
-        
+        if not self.compile( tmpotl ):
+            return False
         if force:
             option = '-M'
         else:
             option = '-m'
         cmd = 'hotl "%s" "%s" "%s"' % (option, tmpotl, otl_path)
         status = os.system( cmd )
-    
         os.remove( tmpotl )
-        return True
+        return status == 0
+
+    # remove temporary files
+    def cleanup( self ):
+        shutil.rmtree( self.Path, ignore_errors=True )
@@ -16,7 +16,12 @@ Copyright 2014 Hans Hoogenboom
    limitations under the License.
 """
 
-import os, sys
+import os, re, sys, json, hashlib, tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 # TODO: export/output of parms????
 
@@ -52,17 +57,149 @@ def _getKeyValue( st ):
     return (key, value)
 
 
-def parseOslInfo( compiledShader ):
-    DEBUG = False
-
+def _runOslInfo( compiledShader ):
     try:
         cmd = 'oslinfo -v %s' % compiledShader
         fp = os.popen(cmd, 'r')
     except:
-        _error("Invalid shaders in file %s.\n" % compileShader)
-        return False
-
+        _error("Invalid shaders in file %s.\n" % compiledShader)
+        return None
     lines = fp.readlines()
+    fp.close()
+    return lines
+
+
+# json reads unicode strings on Python 2, the dialog scripts are written
+# with the byte strings oslinfo returns
+def _native( value ):
+    if isinstance( value, dict ):
+        return dict( ( _native( key ), _native( entry ) ) for key, entry in value.items() )
+    if isinstance( value, list ):
+        return [ _native( entry ) for entry in value ]
+    if sys.version_info[0] < 3 and isinstance( value, unicode ):
+        return value.encode( 'utf-8' )
+    return value
+
+
+# parsed shaders are kept in a cache file between runs, an entry is valid
+# while the .oso file has the same mtime and size or the same content
+class OslInfoCache( object ):
+    def __init__( self, cachefile ):
+        self.path    = cachefile
+        self.entries = self._read()
+        self.added   = {}
+        self.hits    = 0
+        self.misses  = 0
+
+    def _read( self ):
+        try:
+            with open( self.path, 'r' ) as fp:
+                return json.load( fp )
+        except ( IOError, OSError, ValueError ):
+            return {}
+
+    # returns the key of compiledShader and its mtime and size
+    def _describe( self, compiledShader ):
+        key = os.path.abspath( compiledShader )
+        st  = os.stat( key )
+        return ( key, { 'mtime' : st.st_mtime, 'size' : st.st_size } )
+
+    # the parsed shader or None on a cache miss
+    def lookup( self, compiledShader ):
+        ( key, stat ) = self._describe( compiledShader )
+        entry = self.entries.get( key )
+        if entry and entry['size'] == stat['size']:
+            if entry['mtime'] == stat['mtime']:
+                self.hits += 1
+                return _native( entry['shader'] )
+            # rebuilt by oslc without changes
+            if entry['md5'] == fileDigest( key ):
+                entry['mtime'] = stat['mtime']
+                self.added[ key ] = entry
+                self.hits += 1
+                return _native( entry['shader'] )
+        self.misses += 1
+        return None
+
+    def store( self, compiledShader, shader ):
+        ( key, entry ) = self._describe( compiledShader )
+        entry['md5']    = fileDigest( key )
+        entry['shader'] = shader
+        self.entries[ key ] = entry
+        self.added[ key ]   = entry
+
+    # merge the shaders parsed by this process into the cache file, entries
+    # of shaders that no longer exist are evicted
+    def save( self ):
+        if not self.added:
+            return
+        directory = os.path.dirname( os.path.abspath( self.path ) )
+        if not os.path.isdir( directory ):
+            os.makedirs( directory )
+        with open( self.path + '.lock', 'a' ) as lock:
+            if fcntl:
+                fcntl.flock( lock.fileno(), fcntl.LOCK_EX )
+            entries = self._read()
+            entries.update( self.added )
+            for key in list( entries ):
+                if not os.path.isfile( key ):
+                    del entries[ key ]
+            (fd, tmppath) = tempfile.mkstemp( prefix='.oslinfo', dir=directory )
+            with os.fdopen( fd, 'w' ) as fp:
+                json.dump( entries, fp, indent=0, sort_keys=True )
+            if os.name == 'nt' and os.path.exists( self.path ):
+                os.remove( self.path )
+            os.rename( tmppath, self.path )
+        self.entries = entries
+        self.added   = {}
+
+
+def fileDigest( path ):
+    md5 = hashlib.md5()
+    with open( path, 'rb' ) as fp:
+        for block in iter( lambda: fp.read( 1 << 16 ), b'' ):
+            md5.update( block )
+    return md5.hexdigest()
+
+
+# default location of the cache file, set HOUSEED_OSLCACHE to change it
+def defaultCacheFile():
+    cachefile = os.environ.get( 'HOUSEED_OSLCACHE' )
+    if cachefile:
+        return cachefile
+    return os.path.join( os.path.expanduser( '~' ), '.houseed', 'oslinfo.json' )
+
+
+# with a cache oslinfo only runs for new or changed shaders
+def parseOslInfo( compiledShader, cache=None ):
+    if cache is not None:
+        shader = cache.lookup( compiledShader )
+        if shader is not None:
+            return shader
+    shader = _parseOslInfoLines( compiledShader, _runOslInfo( compiledShader ) )
+    if shader and cache is not None:
+        cache.store( compiledShader, shader )
+    return shader
+
+
+# the .oso file is read directly, oslinfo is only run for files the
+# native reader does not understand
+def parseShader( compiledShader, cache=None ):
+    if cache is not None:
+        shader = cache.lookup( compiledShader )
+        if shader is not None:
+            return shader
+    shader = parseOso( compiledShader )
+    if not shader:
+        shader = _parseOslInfoLines( compiledShader, _runOslInfo( compiledShader ) )
+    if shader and cache is not None:
+        cache.store( compiledShader, shader )
+    return shader
+
+
+def _parseOslInfoLines( compiledShader, lines ):
+    DEBUG = False
+
     if not lines:
         _error('Missing shader definition for %s' % compiledShader)
         return False
@@ -138,7 +275,7 @@ def parseOslInfo( compiledShader ):
             if args[0] == "metadata:":
                 (key, value) = _getKeyValue( line )
                 value = _formatVal( value )
-                tempparm[key] = value
+                tempShader[key] = value
                 tempShader['hasMetaData'] = True
   
         if count > length:
@@ -153,3 +290,116 @@ def parseOslInfo( compiledShader ):
             print( "%s: %s" % ( key, tempShader[key] ) )
 
     return tempShader
+
+
+#
+# Native reader of compiled shaders
+#
+
+# tokens of a line of an .oso file: hints like %meta{...}, quoted strings
+# and words separated by white space
+_osoToken = re.compile( r'%\w+\{(?:[^{}"]|"(?:\\.|[^"\\])*")*\}|"(?:\\.|[^"\\])*"|\S+' )
+# fields of a %meta{type,name,value} hint
+_osoField = re.compile( r'"(?:\\.|[^"\\])*"|[^,]+' )
+
+
+# returns ( type, name, value ) of a %meta hint, None for other hints
+def _osoMetadata( hint ):
+    if not hint.startswith( '%meta{' ):
+        return None
+    fields = _osoField.findall( hint[ 6 : -1 ] )
+    if len( fields ) < 3:
+        return None
+    return ( fields[0], fields[1], ' '.join( fields[2:] ) )
+
+
+# default values written as oslinfo writes them, aggregates and arrays
+# between brackets
+def _osoDefault( osltype, values ):
+    if len( values ) == 1 and '[' not in osltype:
+        return values[0]
+    return '[ %s ]' % ' '.join( values )
+
+
+# reads the shader type, parameters, defaults and metadata of a compiled
+# shader and returns them in the same dict as parseOslInfo. The file is
+# read up to the code of the shader. Returns False for files that do not
+# start with the OpenShadingLanguage header.
+def parseOso( compiledShader ):
+    try:
+        fp = open( compiledShader, 'r' )
+    except ( IOError, OSError ):
+        return _error( "Could not read shader %s." % compiledShader )
+
+    tempShader = None
+    parmlist   = list()
+    with fp:
+        # unknown files are left to oslinfo
+        header = fp.readline().split()
+        if not header or header[0] != 'OpenShadingLanguage':
+            return False
+        for line in fp:
+            args = _osoToken.findall( line )
+            if not args or args[0].startswith( '#' ):
+                continue
+            if tempShader is None:
+                if args[0] not in _shaderTypes or len( args ) < 2:
+                    return _error( "Not a valid shader type: %s" % args[0] )
+                tempShader = dict()
+                tempShader['type'] = args[0]
+                tempShader['name'] = args[1]
+                tempShader['hasMetaData'] = False
+                tempShader['hasParmHelp'] = False
+                for hint in args[2:]:
+                    metadata = _osoMetadata( hint )
+                    if metadata:
+                        tempShader[ metadata[1] ] = _formatVal( metadata[2] )
+                        tempShader['hasMetaData'] = True
+                continue
+            if args[0] == 'code':
+                break
+            if args[0] not in [ 'param', 'oparam' ]:
+                continue
+
+            # param type name values hints, closures have a two word type
+            index = 2
+            osltype = args[1]
+            if osltype == 'closure':
+                osltype = '%s %s' % ( args[1], args[2] )
+                index = 3
+            if index >= len( args ):
+                continue
+            hints  = [ arg for arg in args[ index + 1 : ] if arg.startswith( '%' ) ]
+            values = [ arg for arg in args[ index + 1 : ] if not arg.startswith( '%' ) ]
+            # fields of structs are written as parameters of their own
+            if [ hint for hint in hints if hint.startswith( '%struct{' ) ]:
+                continue
+
+            tempparm = dict()
+            tempparm['name'] = args[ index ]
+            tempparm['type'] = osltype
+            if args[0] == 'oparam':
+                tempparm['output'] = True
+            if values:
+                tempparm['value'] = _formatVal( _osoDefault( osltype, values ) )
+            widget = list()
+            for hint in hints:
+                metadata = _osoMetadata( hint )
+                if not metadata:
+                    continue
+                value = _formatVal( metadata[2] )
+                if metadata[1] != 'widget':
+                    tempparm[ metadata[1] ] = value
+                else:
+                    widget.append( value )
+            if len(widget) > 0 and 'widget' not in tempparm:
+                tempparm['widget'] = widget
+            tempShader[tempparm['name']] = tempparm
+            parmlist.append(tempparm['name'])
+            if 'help' in tempparm:
+                tempShader['hasParmHelp'] = True
+
+    if tempShader is None:
+        return _error( 'Missing shader definition for %s' % compiledShader )
+    tempShader['parmlist'] = parmlist
+    return tempShader
@@ -78,6 +78,67 @@ class oslParmEval( ParmEvaluator ):
         return [ ('%s %s' % (parmname, parmtype), parmval) for parmname in self.map.get(name, [name]) ]
 
 
+# split an OSL type as written by oslds.py, "float[3]" is returned as
+# ( 'float', 3 ), types that are not arrays have an array size of 0
+def splitOslType(osltype):
+    start = osltype.find('[')
+    if start < 0:
+        return (osltype.strip(), 0)
+    size = osltype[start + 1 : osltype.find(']', start)]
+    if size.isdigit():
+        return (osltype[:start].strip(), int(size))
+    return (osltype[:start].strip(), 0)
+
+
+# child class of ParmEvaluator which collects the parameters as
+# ( name, OSL type, array size, values ) tuples instead of strings. The
+# parameters are evaluated at the frame being rendered.
+class oslParmList( ParmEvaluator ):
+    def __init__( self, evaluator, precision, options, frame, map=None):
+        ParmEvaluator.__init__(self, evaluator, precision, options, map)
+        self.frame = frame
+
+    # override ParmEvaluator getParmValues method
+    def getParmValues( self, parm, values ):
+        tags = parm.parmTemplate().tags()
+        (osltype, arraysize) = splitOslType( tags.get( 'script_osltype', '' ) )
+        if not osltype:
+            return []
+        if osltype == 'string':
+            values = tuple( parm.evalAsStringsAtFrame( self.frame ) )
+        else:
+            values = tuple( parm.evalAtFrame( self.frame ) )
+        name = parm.name()
+        return [ (parmname, osltype, arraysize, values) for parmname in self.map.get(name, [name]) ]
+
+
+# the Houdini shader type of every clerk style
+__shaderTypes = {
+    "surface"           : 'Surface',
+    "displace"          : 'Displacement',
+    "geometry"          : 'Geometry',
+    "light"             : 'Light',
+    "fog"               : 'Atmosphere',
+}
+
+
+# the shader of a shop as its name and a list of ( name, OSL type, array
+# size, values ) tuples, values is a tuple of floats, ints or strings.
+# Returns None if the shop has no shader of this style.
+def buildShaderParms(style, shopname, time, parmnames=None, options=None):
+    if options is None:
+        options = {}
+    shop = hou.node(shopname)
+    if shop is None or not shaderSupported(style):
+        return None
+    shadertype = getattr(hou.shaderType, __shaderTypes[style], None)
+    if shadertype is None or shop.shaderType() != shadertype:
+        return None
+    frame = hou.timeToFrame(time)
+    parmeval = oslParmList( None, options.get('soho_precision', 12), options, frame )
+    return (shop.shaderName(False, style), parmeval.getShaderParms( shop, frame, parmnames ))
+
+
 def buildShaderString(style, shopname, time, parmnames, options):
     precision = options.get('soho_precision', 12)
     shop = hou.node(shopname)
@@ -30,25 +30,98 @@ Copyright 2014 Hans Hoogenboom
 
 import os
 import sys
+import time
+import json
+import tempfile
 import subprocess
 
+import ASformat
+
 
+# Messages below the level are dropped before they are formatted, the
+# arguments of a message are only applied to it when it is written. The
+# trace file gets a JSON object per line for every message and event.
 class AsLogger( object):
-    def __init__( self, debug_mode = False):
-        self._DEBUG = debug_mode
+    DEBUG   = 10
+    INFO    = 20
+    WARNING = 30
+    ERROR   = 40
+
+    _Levels = { 'debug' : DEBUG, 'info' : INFO, 'warning' : WARNING, 'error' : ERROR }
 
-    def log_debug( self, debug_msg):
+    def __init__( self, debug_mode = False, level = None, trace_file = None):
+        self._DEBUG = debug_mode
+        unknown = None
+        if level is None:
+            level = self.DEBUG if debug_mode else self.INFO
+        elif not isinstance( level, int):
+            # an unknown name falls back to INFO, a string would compare
+            # greater than any level and drop every message
+            name = str( level).strip().lower()
+            if self._Levels.has_key( name):
+                level = self._Levels[name]
+            else:
+                unknown = level
+                level = self.INFO
+        self._level = level
+        self._start = time.time()
+        self._trace = None
+        if trace_file:
+            self._trace = open( trace_file, "w")
+        if unknown is not None:
+            self.log_warning( "Unknown log level '%s', using info.\n", unknown)
+
+    def enabled( self, level):
+        return level >= self._level
+
+    def debug_enabled( self):
+        return self._level <= self.DEBUG
+
+    def trace_enabled( self):
+        return self._trace is not None
+
+    def trace( self, event, **fields):
+        if self._trace is None:
+            return
+        fields['event'] = event
+        fields['time'] = round( time.time() - self._start, 6)
+        self._trace.write( json.dumps( fields, sort_keys = True) + "\n")
+
+    def close( self):
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+    def _message( self, level, msg, args):
+        if args:
+            msg = msg % args
+        if self._trace is not None:
+            self.trace( 'log', level = level, message = msg.rstrip( "\n"))
+        return msg
+
+    def log_debug( self, debug_msg, *args):
         # we only log info when debug is enabled
-        if self._DEBUG:
-            sys.__stdout__.write( 'DEBUG: ' + debug_msg)
+        if self._level <= self.DEBUG:
+            sys.__stdout__.write( 'DEBUG: ' + self._message( 'debug', debug_msg, args))
+
+    def log_info( self, info_msg, *args):
+        if self._level <= self.INFO:
+            info_msg = self._message( 'info', info_msg, args)
+            if self._DEBUG:
+                sys.__stdout__.write( 'INFO: ' + info_msg)
+            else:
+                soho.warning( info_msg )
 
-    def log_info( self, info_msg):
-        if self._DEBUG:
-            sys.__stdout__.write( 'INFO: ' + info_msg)
-        else:
-            soho.warning( info_msg )
+    def log_warning( self, warning_msg, *args):
+        if self._level <= self.WARNING:
+            warning_msg = self._message( 'warning', warning_msg, args)
+            if self._DEBUG:
+                sys.__stdout__.write( 'WARNING: ' + warning_msg)
+            else:
+                soho.warning( warning_msg )
 
-    def log_error( self, error_msg):
+    def log_error( self, error_msg, *args):
+        error_msg = self._message( 'error', error_msg, args)
         if self._DEBUG:
             sys.__stderr__.write( error_msg)
         else:
@@ -58,20 +131,41 @@ class AsLogger( object):
 # AsProjectFileWriter is independent of Houdini, SOHO or any other program/context.
 # It could be reused for any other exporters. In addition, it handles some common
 # errors, like indenting mismatches, some tags open / close issues, etc.
+# Text is collected in memory and written to the file in large chunks, in
+# compact mode the blank lines between entities are left out. Floats are
+# formatted by an ASformat.FloatFormat.
 class AsProjectFileWriter( object):
-    def __init__( self, filename, logger):
+    # number of characters buffered before they are written to the file
+    _FlushSize = 1 << 16
+
+    def __init__( self, filename, logger, compact = False, stream = None, floats = None):
         self._filename = filename
         self._logger = logger
+        self._floats = floats or ASformat.theDefaultFormat
+        self._debug = logger.debug_enabled()
+        self._trace = logger.trace_enabled()
+        self._compact = compact
         self._proj_dir = os.path.dirname( self._filename)
         self._indent_level = 0
-        self._file = open( self._filename, "w")
+        self._indents = [ '' ]
+        self._prefix = ''
+        self._chunks = []
+        self._size = 0
+        self._bytes = 0
+        self._captures = []
+        # the project can be written to an open file or pipe instead
+        if stream:
+            self._file = stream
+        else:
+            self._file = open( self._filename, "w")
 
         # write XML version and encoding
-        self._file.write( '<?xml version="1.0" encoding="UTF-8"?>\n')
+        self._write_text( '<?xml version="1.0" encoding="UTF-8"?>\n')
 
-        self._logger.log_debug( "Created project writer.\n")
-        self._logger.log_debug( "filename = %s\n" % self._filename)
-        self._logger.log_debug( "proj dir = %s\n" % self._proj_dir)
+        if self._debug:
+            self._logger.log_debug( "Created project writer.\n")
+            self._logger.log_debug( "filename = %s\n", self._filename)
+            self._logger.log_debug( "proj dir = %s\n", self._proj_dir)
 
         self._tags_stack = []
 
@@ -79,60 +173,114 @@ class AsProjectFileWriter( object):
     # internal methods
     #
     def _write_text( self, txt):
-        self._file.write( txt)
+        self._chunks.append( txt)
+        self._size += len( txt)
+        for capture in self._captures:
+            capture.append( txt)
+        if self._size >= self._FlushSize:
+            self._flush()
+
+    def _flush( self):
+        if self._chunks:
+            self._bytes += self._size
+            self._file.write( ''.join( self._chunks))
+            self._chunks = []
+            self._size = 0
 
     def _emit_indent( self):
-        self._write_text( " " * self._indent_level * 4)
+        self._write_text( self._prefix)
 
     def _emit_text( self, txt):
-        self._emit_indent()
-        self._write_text( txt)
+        self._write_text( self._prefix + txt)
+
+    # the indent prefixes are built once per level
+    def _set_indent( self, level):
+        self._indent_level = level
+        while len( self._indents) <= level:
+            self._indents.append( " " * len( self._indents) * 4)
+        self._prefix = self._indents[ max( level, 0)]
 
     def _indent( self):
-        self._indent_level += 1
+        self._set_indent( self._indent_level + 1)
 
     def _unindent( self):
         if self._indent_level == 0:
             self._logger.log_error( "Negative indent level requested.\n")
 
-        self._indent_level -= 1
+        self._set_indent( self._indent_level - 1)
 
     def _begin_tag( self, name, values = None):
         self._tags_stack.append( name )
 
         if values:
-            self._logger.log_debug( 'begin tag %s values = %s\n' % ( name, values))
+            if self._debug:
+                self._logger.log_debug( 'begin tag %s values = %s\n', name, values)
             self._emit_text( '<%s %s>\n' % ( name, values))
         else:
-            self._logger.log_debug( 'begin tag %s\n' % name)
+            if self._debug:
+                self._logger.log_debug( 'begin tag %s\n', name)
             self._emit_text( '<%s>\n' % name )
+        if self._trace:
+            self._logger.trace( 'begin', tag = name, attributes = values, depth = self._indent_level)
 
         self._indent()
 
     def _end_tag( self, name):
         if len( self._tags_stack) == 0 or self._tags_stack.pop() != name:
-            self._logger.log_error( "Closing tag %s, that was not opened" % name)            
+            self._logger.log_error( "Closing tag %s, that was not opened", name)
 
         self._unindent()
         self._emit_text( '</%s>\n' % name)
-        self._logger.log_debug( 'end tag %s\n' % name)
+        if self._debug:
+            self._logger.log_debug( 'end tag %s\n', name)
+        if self._trace:
+            self._logger.trace( 'end', tag = name, depth = self._indent_level)
         self._inside_tag = None
 
     def close_project_file( self):
+        self._flush()
         self._file.close()
 
+    def get_logger( self):
+        return self._logger
+
+    def get_project_dir( self):
+        return self._proj_dir
+
+    # characters written so far, including the ones still buffered
+    def get_bytes_written( self):
+        return self._bytes + self._size
+
+    # text written between begin_capture and end_capture is returned by
+    # end_capture, so it can be written again later with emit_raw
+    def begin_capture( self):
+        self._captures.append( [])
+
+    def end_capture( self):
+        return ''.join( self._captures.pop())
+
+    def emit_raw( self, txt):
+        self._write_text( txt)
+
+    # captured text is written again as it is, only at the same indent
+    # level and with the same compact mode
+    def get_layout( self):
+        return ( self._compact, self._indent_level)
+
     #
     # general appleseed tags
     #
     def emit_whiteline( self ):
-        self._write_text( '\n' )
+        if not self._compact:
+            self._write_text( '\n' )
 
     def emit_comment( self, msg):
         if msg != None:
             self._emit_text("<!-- %s -->\n" % msg)
 
     def begin_parm( self, name):
-        self._logger.log_debug( "begin parameters, name = %s\n" % name)
+        if self._debug:
+            self._logger.log_debug( "begin parameters, name = %s\n", name)
         self._begin_tag( 'parameters', 'name="%s"' % name)
 
     def emit_parm( self, name, value):
@@ -140,20 +288,21 @@ class AsProjectFileWriter( object):
 
     def end_parm( self):
         self._end_tag( 'parameters')
-        self._logger.log_debug( "end parameters\n")
+        if self._debug:
+            self._logger.log_debug( "end parameters\n")
 
     def emit_matrix( self, values = None):
         self._begin_tag( 'matrix')
 
+        prefix = self._prefix
         if values == None:
-            self._emit_text( "1.0 0.0 0.0 0.0\n")
-            self._emit_text( "0.0 1.0 0.0 0.0\n")
-            self._emit_text( "0.0 0.0 1.0 0.0\n")
-            self._emit_text( "0.0 0.0 0.0 1.0\n")
+            self._write_text( prefix + "1.0 0.0 0.0 0.0\n" +
+                              prefix + "0.0 1.0 0.0 0.0\n" +
+                              prefix + "0.0 0.0 1.0 0.0\n" +
+                              prefix + "0.0 0.0 0.0 1.0\n")
         else:
-            for i in range(4):
-                self._emit_text( "".join( [ "%f " % values[(i * 4) + j] for j in range(4)]))
-                self._emit_text("\n")
+            row = self._floats.vector( 4, prefix, " " + prefix + "\n")
+            self._write_text( row * 4 % tuple( values[ : 16 ]))
 
         self._end_tag( 'matrix')
 
@@ -231,8 +380,11 @@ class AsProjectFileWriter( object):
     def end_environment( self ):
         self._end_tag( 'environment' )
 
-    def begin_assembly( self, name):
-        self._begin_tag( 'assembly', 'name="%s"' % name)
+    def begin_assembly( self, name, model = None):
+        if model:
+            self._begin_tag( 'assembly', 'name="%s" model="%s"' % ( name, model))
+        else:
+            self._begin_tag( 'assembly', 'name="%s"' % name)
 
     def end_assembly( self):
         self._end_tag( 'assembly')
@@ -343,7 +495,7 @@ class AsProjectFileWriter( object):
 
 
 def convertToString( value ):
-    return ' '.join( map(str, value) )
+    return theFloatFormat.join( value )
 
 
 #####################################################################
@@ -363,6 +515,9 @@ from soho import SohoParm
 from soho import Precision
 from sohog import SohoGeometry
 
+import ASprofile
+import ASformat
+
 
 class SceneObject( object ):
     _sopCache      = []
@@ -378,6 +533,7 @@ class SceneObject( object ):
         self.shopname = None
         self.gblur    = None
         self.xblur    = None
+        self.vblur    = False
 
         _ASGeoSettings = {
             'geo_velocityblur' : SohoParm('geo_velocityblur',  'int', [0], False),
@@ -446,6 +602,13 @@ VelocityBlurSamples = []
 # object containers
 theShaderList   = {}
 
+# shops evaluating to the same shaders share one shader group and
+# material, theMaterialMap maps every shop to the shop whose material
+# it uses, theMaterialShaders holds the evaluated shaders of those
+theMaterialMap        = {}
+theMaterialSignatures = {}
+theMaterialShaders    = {}
+
 
 #
 # Settings from the appleseed render operator
@@ -542,6 +705,41 @@ ASProjectPaths = {
     'as_archivepath' : soho.getDefaultedString( 'as_archivepath', [''] )[0]
 }
 
+#Geometry archive settings, obj or binarymesh
+ASArchiveSettings = {
+    'as_archiveformat' : soho.getDefaultedString( 'as_archiveformat', ['obj'] )[0],
+    'as_archivecache'  : soho.getDefaultedInt( 'as_archivecache', [1] )[0],
+    'as_archivethreads': soho.getDefaultedInt( 'as_archivethreads', [0] )[0],
+    'as_archivepool'   : soho.getDefaultedString( 'as_archivepool', ['thread'] )[0],
+    'as_archiveweld'   : soho.getDefaultedInt( 'as_archiveweld', [0] )[0],
+    'as_weldtolerance' : soho.getDefaultedFloat( 'as_weldtolerance', [0.0] )[0],
+    'as_streampoints'  : soho.getDefaultedInt( 'as_streampoints', [1000000] )[0],
+    'as_streamchunk'   : soho.getDefaultedInt( 'as_streamchunk', [65536] )[0],
+    'as_autoinstance'  : soho.getDefaultedInt( 'as_autoinstance', [1] )[0]
+}
+
+#Project file settings
+ASExportSettings = {
+    'as_compactxml'    : soho.getDefaultedInt( 'as_compactxml', [0] )[0],
+    'as_fragmentcache' : soho.getDefaultedInt( 'as_fragmentcache', [1] )[0],
+    'as_sequence'      : soho.getDefaultedInt( 'as_sequence', [0] )[0],
+    'as_staticfile'    : soho.getDefaultedString( 'as_staticfile', [''] )[0],
+    'as_loglevel'      : soho.getDefaultedString( 'as_loglevel', ['info'] )[0],
+    'as_tracefile'     : soho.getDefaultedString( 'as_tracefile', [''] )[0],
+    'as_profile'       : soho.getDefaultedInt( 'as_profile', [0] )[0],
+    'as_render_mode'   : soho.getDefaultedString( 'as_render_mode', ['export'] )[0],
+    'as_clicommand'    : soho.getDefaultedString( 'as_clicommand', ['appleseed.cli'] )[0],
+    'as_filetype'      : soho.getDefaultedInt( 'as_filetype', [0] )[0],
+    'as_filename'      : soho.getDefaultedString( 'as_filename', [''] )[0],
+    'soho_precision'   : soho.getDefaultedInt( 'soho_precision', [ASformat.DefaultPrecision] )[0]
+}
+
+# timing of the export phases, only measured when profiling is on
+theProfiler = ASprofile.Profiler( ASExportSettings['as_profile'] )
+
+# significant digits of the floats in the project and the obj archives
+theFloatFormat = ASformat.FloatFormat( ASExportSettings['soho_precision'] )
+
 
 #####################################################################
 #                                                                   #
@@ -556,17 +754,55 @@ ASProjectPaths = {
 #
 
 
-import time, sys, string, math, os 
+import time, sys, string, math, os, hashlib
+from xml.sax.saxutils import escape
 import hou, soho
 from soho import SohoParm
 from soho import Precision
 from sohog import SohoGeometry
 
+import ASarchive
+import ASvelocity
+import ASinstance
+import ASfragment
+
+# the OSL clerk hands the shader parameters over as values, without it
+# the shader strings of SOHO are parsed
+try:
+    from shopclerks import oslclerk
+except ImportError:
+    oslclerk = None
+
 
 #
 # Process shaders and textures
 #
+
+# value of an OSL shader parameter as appleseed reads it, arrays are
+# written with [] after the type, strings are escaped for the xml
+def oslParmValue( osltype, arraysize, values ):
+    value = theFloatFormat.join( values )
+    if osltype == 'string':
+        value = escape( value, { '"' : '&quot;' } )
+    if arraysize:
+        osltype += '[]'
+    return osltype + ' ' + value
+
+
+# a shader is either the ( shadername, parameters ) of the OSL clerk or
+# a shader string of SOHO
 def processShop( shader, key, writer ):
+    if isinstance( shader, tuple ):
+        (shopname, parms) = shader
+        writer.begin_shader( key, shopname, shopname + "1" )
+        for (name, osltype, arraysize, values) in parms:
+            # empty strings are not written, like tabs of the interface
+            if not values or ( osltype == 'string' and not ''.join( values ) ):
+                continue
+            writer.emit_parm( name, oslParmValue( osltype, arraysize, values ) )
+        writer.end_shader()
+        return
+
     # first entry is the shopname
     # then the parameters, type and values delimited by ,
     argend = shader.find('"', 1)
@@ -595,6 +831,13 @@ _ShaderContext = {
     'volume'       : 'shop_volumepath',
     }
 
+# styles of the OSL clerk for the shader contexts
+_ShaderStyle = {
+    'surface'      : 'surface',
+    'displacement' : 'displace',
+    'volume'       : 'fog',
+    }
+
 _ShaderSkipContext = {
     'surface'      : 'shop_disable_surfacepath',
     'displacement' : 'shop_disable_displacepath',
@@ -609,30 +852,53 @@ def isContextDisabled(obj, now, wrangler, context):
         return obj.wrangleInt( wrangler, _ShaderSkipContext[ context ], now, [0] )[0]
 
 
-def wrangleMaterial( shopname, shop, now, writer, wrangler=None ):
-    shg_name = "/shg" + shopname    
-    writer.begin_shader_group( shg_name )
-
-    shaders = {}
-    if wrangler:
-        for context in _ShaderContext:
-            if isContextDisabled( shop, now, wrangler, context ):
-                continue
-            shadertype = _ShaderContext[ context ]
+# the evaluated shader strings of a shop as ( context, shader ) pairs
+def evaluateMaterial( shop, now, wrangler=None ):
+    shaders = []
+    for context in sorted( _ShaderContext ):
+        if isContextDisabled( shop, now, wrangler, context ):
+            continue
+        shadertype = _ShaderContext[ context ]
+        if wrangler:
             # Uses the osclerks.py script in $HH/pythonlibs2.xlibs/shopclerks to
             # query the shader parameters. Only returns NON default values
             # the shader is a formatted string with all the parameters etc.
             shader = shop.wrangleShader( wrangler, shadertype, now, [''] )[0]
-            if shader:
-                shaders[ context ] = processShop( shader, writer )
-    else:
-        for context in _ShaderContext:
-            if isContextDisabled( shop, now, wrangler, context ):
-                continue
-            shadertype = _ShaderContext[ context ]
-            shader = shop.getDefaultedShader( shadertype, now, [''] )[0]
-            if shader:
-                shaders[ context ] = processShop( shader, context, writer )
+        else:
+            shader = None
+            if oslclerk is not None:
+                shader = oslclerk.buildShaderParms( _ShaderStyle[ context ], shop.getName(), now )
+            if shader is None:
+                shader = shop.getDefaultedShader( shadertype, now, [''] )[0]
+        if shader:
+            shaders.append( ( context, shader ) )
+    return shaders
+
+
+# a shop is mapped to the first shop with the same evaluated shaders,
+# only that one gets a shader group and material
+def addMaterial( shopname, shop, now ):
+    shaders   = evaluateMaterial( shop, now )
+    signature = hashlib.md5( repr( shaders ).encode( 'utf-8' ) ).hexdigest()
+    canonical = theMaterialSignatures.setdefault( signature, shopname )
+    theMaterialMap[ shopname ] = canonical
+    if canonical == shopname:
+        theMaterialShaders[ shopname ] = shaders
+
+
+def clearMaterials():
+    theShaderList.clear()
+    theMaterialMap.clear()
+    theMaterialSignatures.clear()
+    theMaterialShaders.clear()
+
+
+def wrangleMaterial( shopname, shaders, writer ):
+    shg_name = "/shg" + shopname    
+    writer.begin_shader_group( shg_name )
+
+    for context, shader in shaders:
+        processShop( shader, context, writer )
     #TODO: how to get the correct closure of an osl shader?
     if len( shaders ) > 1:
         writer.emit_connect_shaders( "a", "b", "c", "d" )
@@ -644,16 +910,19 @@ def outputMaterial( now, writer ):
     global theShaderList
 
     #write shader groups - write materials (possibly consisting of several shops)
-    for shopname in theShaderList:
-        wrangleMaterial( shopname, theShaderList[shopname], now, writer )
+    materials = sorted( theMaterialShaders )
+    for shopname in materials:
+        wrangleMaterial( shopname, theMaterialShaders[shopname], writer )
+    if len( materials ) < len( theShaderList ):
+        writer.emit_comment( " %d shops share %d materials " % ( len( theShaderList ), len( materials ) ) )
 
     #write surface_shader (and possibly others)
-    if len( theShaderList ) > 0:
+    if len( materials ) > 0:
         writer.begin_surfaceshader()
         writer.end_surfaceshader()
 
     #write material tags
-    for shopname in theShaderList:
+    for shopname in materials:
         materialname = "/mat" + shopname
         shopname     = "/shg" + shopname
         writer.begin_material( materialname, 'osl_material' )
@@ -675,6 +944,7 @@ def getMaterial( path, now ):
         shopname = shop.getName()
         if shopname not in theShaderList:
             theShaderList[shopname] = shop
+            addMaterial( shopname, shop, now )
     else:
         shopname = None
         shop = None
@@ -712,113 +982,330 @@ def partitionMaterial( geoList, attrib ):
 #####################################################################
 
 
-def computeVBounds( geo, bbox, tscale ):
-    vbox  = [0, 0, 0, 0, 0, 0 ]
-    vattr = geo.attribute( 'geo:point', 'v' )
-    if vattr > 0:
-        npts = geo.globalValue( 'geo:pointcount' )[0]
-        for pt in range( npts ):
-            v = geo.value( vattr, pt )
-            vbox[0] = min( vbox[0], v[0]*tscale )
-            vbox[1] = min( vbox[1], v[1]*tscale )
-            vbox[2] = min( vbox[2], v[2]*tscale )
-            vbox[3] = max( vbox[0], v[0]*tscale )
-            vbox[4] = max( vbox[1], v[1]*tscale )
-            vbox[5] = max( vbox[2], v[2]*tscale )
-    vbounds = [ x + y for x, y in zip( vbox, bbox ) ]
-    return vbounds
-
-
-#in case of velocity blur we have to deforming geometry
-def movePoints( geo, tscale ):
-    vattr = geo.attribute( 'geo:point', 'v' )
-    if vattr > 0:
-        npts = geo.globalValue( 'geo:pointcount' )[0]
-        pnt  = geo.attribute( 'geo:point', 'P' )
-        vattr = geo.attribute( 'geo:point', 'v' )
-        for pt in range( npts ):
-            pos = geo.value( pnt, pt )
-            vel = geo.value( vattr, pt )
-            vp  = [ p + v * tscale for p, v in zip( pos, vel ) ]
-        return vp
-
-
-#save as a wavefront obj file VERSION 2, WORKS
-#fix output of appleseed object and object_instances
-def saveObjArchives( geo, name, time_sample ):
-        print( '#archive created at %s' % time.ctime() )
-        print( '#name: %s' % name )
-        bounds = geo.globalValue( 'geo:boundingbox' )
-        print( "# bounds: %s" % convertToString( bounds ) )
-        print( "# time sample at: %s" % time_sample )
-        nprims = geo.globalValue( 'geo:primcount' )[0]
-        npts   = geo.globalValue( 'geo:pointcount' )[0]
-
-        #write point positions
-        print( "\n# %d vertices" % npts )
-        pnt = geo.attribute( 'geo:point', 'P' )
-        v_handle = geo.attribute( 'geo:point', 'v' )
-        if v_handle < 0:
-            for pts in range( npts ):
-                pos = geo.value( pnt, pts )
-                print( "v %f %f %f" % ( pos[0], pos[1], pos[2] ) )
+# archive format : ( file extension, writer, binary file, stream writer )
+# obj archives are wavefront obj files, the geometry is fetched in bulk
+# and written in preformatted blocks
+_ArchiveFormats = {
+    'obj'        : ( '.obj',        ASarchive.writeObjArchive,        False, ASarchive.streamObjArchive ),
+    'binarymesh' : ( '.binarymesh', ASarchive.writeBinaryMeshArchive, True,  ASarchive.streamBinaryMeshArchive ),
+}
+
+# archive cache and pool of archive writers, shared by all objects of a frame
+theArchiveCache = None
+theArchivePool  = None
+
+
+# the archive format selected on the ROP, obj is the fallback
+def getArchiveFormat():
+    archive_format = ASArchiveSettings['as_archiveformat']
+    if not _ArchiveFormats.has_key( archive_format ):
+        soho.warning( "Unknown archive format %s, using obj" % archive_format )
+        archive_format = 'obj'
+    return archive_format
+
+
+# get base path for storing archive files
+def getArchivePath( now ):
+    (cwd, paths) = getProjectPaths( now )
+    if paths.has_key('as_archivepath'):
+        path = paths['as_archivepath']
+    else:
+        path = cwd
+    if os.path.isabs( path ):
+        as_archivepath = path
+    else:
+        as_archivepath = os.path.join( cwd, path )
+    return ( path, as_archivepath )
+
+
+# weld tolerance for uvs and normals, None writes them unwelded
+def getArchiveWeld():
+    if ASArchiveSettings['as_archiveweld']:
+        return max( ASArchiveSettings['as_weldtolerance'], 0.0 )
+    return None
+
+
+# queue the archive on the pool of archive writers
+def saveArchives( mesh, name, time_sample, filepath, archive_format, done=None, failed=None ):
+    (extension, writeArchive, binary, streamArchive) = _ArchiveFormats[ archive_format ]
+    theArchivePool.submit( writeArchive, binary, mesh, name, time_sample, filepath,
+                           getArchiveWeld(), theFloatFormat, done, failed )
+
+
+# queue the archive of one partition and time sample and return the
+# filename. With the archive cache the file is named after its content
+# and only written if no other frame or process wrote it before.
+def saveGeoArchive( mesh, partname, shopname, timecounter, time_sample, as_archivepath ):
+    archive_format = getArchiveFormat()
+    extension = _ArchiveFormats[ archive_format ][0]
+
+    if theArchiveCache is None:
+        filename = os.path.basename( partname ) + "_%d" % timecounter + extension
+        saveArchives( mesh, partname, time_sample, as_archivepath + '/' + filename, archive_format )
+        return filename
+
+    key = ASarchive.meshKey( mesh, [ archive_format, shopname, getArchiveWeld(), theFloatFormat.spec ] )
+    filename = theArchiveCache.lookup( key )
+    if filename is None:
+        filename = key + extension
+        tmppath  = theArchiveCache.reserve( key, filename )
+        saveArchives( mesh, partname, time_sample, tmppath, archive_format,
+                      lambda: theArchiveCache.commit( key ),
+                      lambda: theArchiveCache.discard( key ) )
+    return filename
+
+
+# meshes with more points than as_streampoints are written while they
+# are read, see ASarchive.GeometryStream
+def isStreamed( geo ):
+    return geo.globalValue( 'geo:pointcount' )[0] > ASArchiveSettings['as_streampoints']
+
+
+# stream the archive of one partition and time sample in the SOHO thread
+# and return the filename, None if it could not be written. With the
+# archive cache the archive is written to a temporary file and named
+# after its content when it is complete.
+def saveStreamedArchive( stream, partname, shopname, timecounter, time_sample, as_archivepath ):
+    archive_format = getArchiveFormat()
+    (extension, writeArchive, binary, streamArchive) = _ArchiveFormats[ archive_format ]
+
+    if theArchiveCache is None:
+        filename = os.path.basename( partname ) + "_%d" % timecounter + extension
+        filepath = as_archivepath + '/' + filename
+    else:
+        filepath = theArchiveCache.temporary()
+    args = ( streamArchive, binary, stream, partname, time_sample, filepath, theFloatFormat )
+    if not theArchivePool.run( ASarchive.streamArchive, args, filepath,
+                               failed=lambda: os.path.exists( filepath ) and os.remove( filepath ) ):
+        return None
+    if theArchiveCache is None:
+        return filename
+    # streamed meshes are not welded
+    key = stream.key( [ archive_format, shopname, None, theFloatFormat.spec ] )
+    return theArchiveCache.adopt( key, filepath, extension )
+
+
+# the archive cache and writers are set up for each frame, the
+# manifest on disk is shared between frames and processes
+def beginArchives( now ):
+    global theArchiveCache, theArchivePool
+
+    theArchiveCache = None
+    if ASArchiveSettings['as_archivecache']:
+        (path, as_archivepath) = getArchivePath( now )
+        theArchiveCache = ASarchive.ArchiveCache( as_archivepath )
+    theArchivePool = ASarchive.ArchivePool( ASArchiveSettings['as_archivethreads'],
+                                            ASArchiveSettings['as_archivepool'] == 'process' )
+
+
+# all archives have to be written before the project is closed
+def endArchives( writer ):
+    with theProfiler.phase( 'archive wait' ):
+        errors = theArchivePool.join()
+    for error in errors:
+        writer.get_logger().log_error( "%s\n", error )
+    # time spent by the archive writers, they run next to the export
+    theProfiler.add( 'archive write', theArchivePool.seconds, theArchivePool.written )
+    theProfiler.count( 'archives', theArchivePool.written )
+    theProfiler.count( 'archive bytes', theArchivePool.bytes )
+    if theArchiveCache is None:
+        return
+    theArchiveCache.save()
+    writer.emit_comment( "Archive cache: %d hits, %d misses" %
+                         ( theArchiveCache.hits, theArchiveCache.misses ) )
+
+
+# SohoGeometry interface on top of a hou.Geometry, used for the geometry
+# of packed primitives which has no sop to evaluate with SOHO
+class HouGeometry( object ):
+    def __init__( self, geo ):
+        self.geo     = geo
+        self.Handle  = 0
+        self.prims   = geo.prims()
+        self.npts    = len( geo.points() )
+        self.handles = []
+
+    def _addHandle( self, values ):
+        self.handles.append( values )
+        return len( self.handles ) - 1
+
+    def globalValue( self, name ):
+        if name == 'geo:pointcount':
+            return [ self.npts ]
+        if name == 'geo:primcount':
+            return [ len( self.prims ) ]
+        if name == 'geo:boundingbox':
+            box = self.geo.boundingBox()
+            return list( box.minvec() ) + list( box.maxvec() )
+        return None
+
+    def attribute( self, style, name ):
+        if style == 'geo:prim' and name == 'geo:vertexcount':
+            return self._addHandle( [ [ len( prim.vertices() ) ] for prim in self.prims ] )
+        if style == 'geo:vertex' and name == 'geo:pointref':
+            return self._addHandle( [ [ [ vtx.point().number() ] for vtx in prim.vertices() ]
+                                      for prim in self.prims ] )
+        if style == 'geo:point':
+            attrib = self.geo.findPointAttrib( name )
+            if attrib is None or attrib.dataType() != hou.attribData.Float:
+                return -1
+            values = self.geo.pointFloatAttribValues( name )
+            size   = attrib.size()
+            return self._addHandle( [ values[ i : i + size ] for i in xrange( 0, len( values ), size ) ] )
+        if style == 'geo:vertex':
+            attrib = self.geo.findVertexAttrib( name )
+            if attrib is None or attrib.dataType() != hou.attribData.Float:
+                return -1
+            return self._addHandle( [ [ vtx.attribValue( attrib ) for vtx in prim.vertices() ]
+                                      for prim in self.prims ] )
+        return -1
+
+    # point normals are the average of the normals of the faces using the point
+    def normal( self ):
+        N = [ [ 0.0, 0.0, 0.0 ] for pt in xrange( self.npts ) ]
+        for prim in self.prims:
+            if len( prim.vertices() ) < 3:
+                continue
+            nrml = prim.normal()
+            for vtx in prim.vertices():
+                acc = N[ vtx.point().number() ]
+                acc[0] += nrml[0]
+                acc[1] += nrml[1]
+                acc[2] += nrml[2]
+        for acc in N:
+            length = math.sqrt( acc[0] * acc[0] + acc[1] * acc[1] + acc[2] * acc[2] )
+            if length > 0:
+                acc[0] /= length
+                acc[1] /= length
+                acc[2] /= length
+        return self._addHandle( N )
+
+    def value( self, handle, index ):
+        return self.handles[ handle ][ index ]
+
+    def vertex( self, handle, prim, vtx ):
+        return self.handles[ handle ][ prim ][ vtx ]
+
+
+# names of the packed primitive types
+_PackedTypes = ( 'PackedGeometry', 'PackedDisk', 'PackedDiskSequence', 'PackedFragment' )
+
+
+# checked once per object, geometry without packed primitives is not
+# scanned. Houdini versions without containsPrimType always scan.
+def hasPackedPrims( ASobj ):
+    if ASobj.housop is None:
+        return False
+    geo = ASobj.housop.geometry()
+    if geo is None:
+        return False
+    contains = getattr( geo, 'containsPrimType', None )
+    if contains is None:
+        return True
+    for name in _PackedTypes:
+        try:
+            if contains( name ):
+                return True
+        except Exception:
+            # not a primitive type of this Houdini version
+            continue
+    return False
+
+
+# the packed primitives of an object as ( key, load, transform ), load()
+# returns the geometry of the primitive. Primitives sharing their source
+# geometry have the same key and the same load, the geometry is only
+# fetched when a source is written. Embedded geometry is identified by
+# its geometryid intrinsic, which is shared by all its packed primitives.
+def getPackedPrims( ASobj, now ):
+    if not hasPackedPrims( ASobj ):
+        return []
+    gdp = SohoGeometry( ASobj.soppath, now )
+    if gdp.Handle < 0:
+        return []
+    value     = gdp.value
+    attr_type = gdp.attribute( 'geo:prim', 'intrinsic:typename' )
+    vtxs      = gdp.attribute( 'geo:prim', 'geo:vertexcount' )
+    nprims    = gdp.globalValue( 'geo:primcount' )[0]
+    # a packed primitive has a single vertex, check that first
+    packed = [ prim for prim in xrange( nprims )
+               if value( vtxs, prim )[0] == 1 and value( attr_type, prim )[0].startswith( 'Packed' ) ]
+    if not packed:
+        return []
+
+    xform    = gdp.attribute( 'geo:prim', 'intrinsic:packedfulltransform' )
+    filename = gdp.attribute( 'geo:prim', 'intrinsic:filename' )
+    geoid    = gdp.attribute( 'geo:prim', 'intrinsic:geometryid' )
+    hou_geo  = []
+    sources  = {}
+    prims    = []
+
+    def houPrim( prim ):
+        if not hou_geo:
+            hou_geo.append( ASobj.housop.geometry().iterPrims() )
+        return hou_geo[0][ prim ]
+
+    def loadFile( path ):
+        geo = hou.Geometry()
+        geo.loadFromFile( path )
+        return HouGeometry( geo )
+
+    def loadEmbedded( prim ):
+        hou_prim = houPrim( prim )
+        if not hasattr( hou_prim, 'getEmbeddedGeometry' ):
+            soho.warning( "Unsupported packed primitive %d on object: %s" % ( prim, ASobj.getName() ) )
+            return None
+        return HouGeometry( hou_prim.getEmbeddedGeometry() )
+
+    for prim in packed:
+        path = None
+        if filename >= 0:
+            path = value( filename, prim )
+            path = path and path[0]
+        gid = None
+        if not path and geoid >= 0:
+            gid = value( geoid, prim )
+            gid = gid and gid[0]
+
+        if path:
+            key  = ( 'file', path )
+            load = ( loadFile, path )
+        elif gid is not None:
+            key  = ( 'geometry', gid )
+            load = ( loadEmbedded, prim )
         else:
-            for pts in range( npts ):
-                pos  = geo.value( pnt, pts )
-                v    = geo.value( v_handle,   pts )
-                print( "v " + "".join( [" %f" % ( pos[i] + v[i] * time_sample ) for i in range( 3 ) ] ) )
-
-        #write uv/texture coordinates
-        prim_uv = dict()
-        counter = 1
-        uv      = geo.attribute( 'geo:vertex', 'uv' )
-        vtxs    = geo.attribute( 'geo:prim', 'geo:vertexcount')
-        if uv > 0:
-            print ("\n# uv coordinates")
-            for prim in range( nprims ):
-                uvLst = []
-                nv    = geo.value( vtxs, prim)[0]
-                for vtx in range( nv ):
-                    uvCoord = geo.vertex( uv, prim, vtx )
-                    print( "vt %f %f %f" % ( uvCoord[0], uvCoord[1], uvCoord[2] ) )
-                    uvLst.append( counter )
-                    counter += 1
-                uvLst = [uvLst[0]] + uvLst[-1:0:-1]
-                prim_uv[ prim ] = uvLst
-
-        #write normals
-        nrml = geo.attribute( 'geo:point', "N" )
-        nstr = "\n# normals"
-        #if no normals, calculate the normals
-        if nrml < 0:
-            nrml = geo.normal()
-            nstr = "\n# soho calculated normals"
-        print( nstr )
-        for pts in range( npts ):
-            pnt_nrml = geo.value( nrml, pts )
-            print( "vn %f %f %f" % ( pnt_nrml[0], pnt_nrml[1], pnt_nrml[2] ) )
-
-        #write faces
-        nvts   = geo.attribute( 'geo:prim', 'geo:vertexcount' )
-        pntRef = geo.attribute( 'geo:vertex', 'geo:pointref' )
-        print( "\n# %d faces" % nprims )
-        for prim in range( nprims ):
-            nvtx =  geo.value( nvts, prim )[0]
-            vtxList = []
-            nrmList = []
-            for vtx in range( nvtx ):
-                curpnt = geo.vertex( pntRef, prim, vtx )[0] + 1
-                vtxList.append( curpnt )
-                nrmList.append( curpnt )
-            #reverse vertices and normals so we go CCW
-            vtxList = [vtxList[0]] + vtxList[-1:0:-1]
-            nrmList = [nrmList[0]] + nrmList[-1:0:-1]
-            #we have normals and faces
-            if uv < 0:
-                print( "f" + "".join([" %d//%d " % (vtxList[vtx], nrmList[vtx]) for vtx in range(nvtx)]) )
-            # or faces, uv's and normals
-            else:
-                print( "f" + "".join( [" %d/%d/%d " % (vtxList[vtx], prim_uv[prim][vtx], nrmList[vtx]) for vtx in range(nvtx)] ) )
+            # without the intrinsic the content of the geometry is the key
+            geo = loadEmbedded( prim )
+            if geo is None:
+                continue
+            key  = ( 'geometry', ASarchive.meshKey( ASarchive.fetchMeshBuffer( geo ), [] ) )
+            load = ( lambda geo: geo, geo )
+        if not sources.has_key( key ):
+            sources[ key ] = _memoise( *load )
+        prims.append( ( key, sources[ key ], list( value( xform, prim ) ) ) )
+    return prims
+
+
+# load( arg ) is called once, later calls return its first result
+def _memoise( load, arg ):
+    result = []
+    def memoised():
+        if not result:
+            result.append( load( arg ) )
+        return result[0]
+    return memoised
+
+
+# archive of the geometry of a packed primitive, the primitives are
+# written with the material of the packing object
+def savePackedArchive( ASobj, geo, name, now ):
+    (path, as_archivepath) = getArchivePath( now )
+    (shopname, shop) = getPartitionMaterial( ASobj, None, now )
+    mesh = ASarchive.fetchMeshBuffer( geo )
+    if not mesh.nprims:
+        return None
+    filename = saveGeoArchive( mesh, name, shopname, 0, now, as_archivepath )
+    return { 1 : [ path, [ filename ], shopname, None ] }
 
 
 # appleseed only supports closed polygons at the moment
@@ -866,8 +1353,73 @@ def groupByPrimitiveType( geo ):
         return None
 
 
-# appleseed only works with wavefront obj format so we
-# need to write the vertices, faces and points to a file
+# material of a partition, shoppath is the material on the primitives
+def getPartitionMaterial( ASobj, shoppath, now ):
+    if shoppath:
+        return getMaterial( shoppath, now )
+    # no shops? Then we probably have a material set on the object!
+    obj_material_path = ASobj.obj.getDefaultedString('shop_materialpath', now, [''])[0]
+    if obj_material_path:
+        return getMaterial( obj_material_path, now)
+    # no shader present
+    return ( None, None )
+
+
+# with velocity blur every time sample holds the same geometry, P and v
+# are fetched once and displaced for all samples in one pass. With
+# deformation blur only P and N are fetched for the later samples as
+# long as the topology does not change.
+def fetchTimeSamples( ASobj, geoList, time_samples ):
+    if ASobj.vblur:
+        with theProfiler.phase( 'fetch' ):
+            mesh = ASarchive.fetchMeshBuffer( geoList[0], True )
+            meshes = ASvelocity.velocityMeshes( mesh, time_samples[ : len( geoList ) ] )
+        for moved in meshes:
+            countMesh( moved )
+            yield moved
+    else:
+        with theProfiler.phase( 'fetch' ):
+            mesh = ASarchive.fetchMeshBuffer( geoList[0] )
+        countMesh( mesh )
+        yield mesh
+        for geo in geoList[1:]:
+            with theProfiler.phase( 'fetch' ):
+                if ASarchive.sameTopology( mesh, geo ):
+                    sample = ASarchive.fetchPointSample( mesh, geo )
+                else:
+                    sample = ASarchive.fetchMeshBuffer( geo )
+            countMesh( sample )
+            yield sample
+
+
+# the streamed counterpart of fetchTimeSamples and saveGeoArchive, every
+# time sample is read and written in chunks
+def streamTimeSamples( ASobj, geoList, time_samples, partname, shopname, as_archivepath ):
+    filenames = []
+    for timecounter, geo in enumerate( geoList ):
+        velocity = None
+        if ASobj.vblur:
+            velocity = time_samples[ timecounter ]
+        with theProfiler.phase( 'stream' ):
+            stream = ASarchive.GeometryStream( geo, ASArchiveSettings['as_streamchunk'], velocity )
+            if not stream.nprims:
+                break
+            filename = saveStreamedArchive( stream, partname, shopname, timecounter,
+                                            time_samples[ timecounter ], as_archivepath )
+        countMesh( stream )
+        if filename is None:
+            break
+        filenames.append( filename )
+    return filenames
+
+
+def countMesh( mesh ):
+    theProfiler.count( 'points', mesh.npts )
+    theProfiler.count( 'primitives', mesh.nprims )
+
+
+# appleseed reads meshes from wavefront obj or binarymesh files so
+# we need to write the vertices, faces and points to a file
 # and return the filepath for the appleseed object tag
 def parseGeoObject( ASobj, now, name ):
 
@@ -885,7 +1437,7 @@ def parseGeoObject( ASobj, now, name ):
             v_handle = gdp.attribute( 'geo:point', 'v' )
             if v_handle >= 0:
                 if gdp.attribProperty( v_handle, 'geo:vectorsize' )[0] != 3:
-                    v_handle = False
+                    v_handle = -1
                 if v_handle >= 0:
                     ASobj.vblur = True
             # we have velocity blur, overrule deformation
@@ -914,52 +1466,34 @@ def parseGeoObject( ASobj, now, name ):
     # matGeo is a dict with material as key, primitives as value
     partGeo = partitionMaterial( geoList, 'shop_materialpath' )
 
-    # get base path for storing obj files
-    (cwd, paths) = getProjectPaths( now )
-    if paths.has_key('as_archivepath'):
-        path = paths['as_archivepath']
-    else:
-        path = cwd
-    if os.path.isabs( path ):
-        as_archivepath = path
-    else:
-        as_archivepath = os.path.join( cwd, path )
+    (path, as_archivepath) = getArchivePath( now )
 
     partionedObjects = {}
     shopcounter = 0    
     for shoppath in partGeo:
-        if shoppath:
-            (shopname, shop) = getMaterial( shoppath, now )
-        else:
-            # no shops? Then we probably have a material set on the object!
-            obj_material_path = ASobj.obj.getDefaultedString('shop_materialpath', now, [''])[0]
-            if obj_material_path:
-                (shopname, shop) = getMaterial( obj_material_path, now)
-            else:
-                # no shader present
-                shop = None
-                shopname = None
+        (shopname, shop) = getPartitionMaterial( ASobj, shoppath, now )
 
         partname = '%s-mat%d' % ( name, shopcounter )
         shopcounter += 1
 
         filenameList = []
-        save_stdout = sys.stdout
-        timecounter = 0
-        # enumerate?
-        for timesample in partGeo[shoppath]:
-            filename = os.path.basename( partname ) + "_%d" % timecounter
-            filepath = as_archivepath + '/' + filename + '.obj'
+        if isStreamed( partGeo[shoppath][0] ):
+            filenameList = streamTimeSamples( ASobj, partGeo[shoppath], time_samples, partname,
+                                              shopname, as_archivepath )
+            meshes = []
+        else:
+            meshes = fetchTimeSamples( ASobj, partGeo[shoppath], time_samples )
+        for timecounter, mesh in enumerate( meshes ):
+            # nothing but packed primitives, curves or points
+            if not mesh.nprims:
+                break
+            filename = saveGeoArchive( mesh, partname, shopname, timecounter,
+                                       time_samples[ timecounter ], as_archivepath )
             filenameList.append( filename )
+        if not filenameList:
+            continue
 
-            with open( filepath, 'w' ) as fp:
-                sys.stdout = fp
-                saveObjArchives( timesample, partname, time_samples[ timecounter ] )
-
-            timecounter += 1
-
-        sys.stdout = save_stdout
-        archives = [ path, filenameList, shopname ]
+        archives = [ path, filenameList, shopname, shoppath ]
         partionedObjects[ shopcounter ] = archives
 
     # return dictioanry with shopname and a list containing 
@@ -1236,19 +1770,30 @@ def getObjectWrangler( obj, now, style ):
     return wrangler
     
 
-def instanceTransform( obj, time, writer ):
+identMat = [ 1.0, 0.0, 0.0, 0.0,
+             0.0, 1.0, 0.0, 0.0,
+             0.0, 0.0, 1.0, 0.0,
+             0.0, 0.0, 0.0, 1.0 ]
+
+
+# world transform of an object in houdini convention
+def worldTransform( obj, time ):
     xform = []
+    if not obj.evalFloat( 'space:world', time, xform ):
+        xform = identMat
+    if len(xform) != 16:
+        xform = identMat
+    return xform
 
+
+def instanceTransform( obj, time, writer ):
     #if "invert" in method:
     #    xform = list( hou.Matrix4( xform ).inverted().asTuple() )
     #if "swap" in method:
     #    swap_matrix = hou.Matrix4( (-1,0,0,0, 0,1,0,0, 0,0,-1,0, 0,0,0,1) )
     #    swapped = hou.Matrix4( xform ) * swap_matrix
     #    xform = list( swapped.asTuple() )
-    if not obj.evalFloat( 'space:world', time, xform ):
-        xform = identMat
-    if len(xform) != 16:
-        xform = identMat
+    xform = worldTransform( obj, time )
 
     #always transpose the matrix, appleseed post multiplies matrices
     xform = list( hou.Matrix4( xform ).transposed().asTuple() )
@@ -1331,7 +1876,7 @@ def defineCamera( cam, now, writer ):
         crop[3] = int( (resolution[1] - 1) * crop[3] )
         outputParms['crop_window'] = convertToString( crop )
 
-    cam_parms['film_dimensions']   = "%s %s" % (apx, apy)
+    cam_parms['film_dimensions']   = convertToString( [apx, apy] )
     #cam_parms['film_height'   =  aperture * aspect
     cam_parms['focal_length'] = focal
     #cam_parms['focal_distance'] = focal[0]
@@ -1413,62 +1958,301 @@ def outputLight( light, now, writer ):
     return name
 
 
-def outputGeometry( ASobj, now, writer ):
+# the objects written for an object, partition shoppaths are kept so a
+# later instance can use the material of its own object
+def instanceObjects( ASobj, objects, now ):
+    instances = []
+    for objname, shoppath in objects:
+        (shopname, shop) = getPartitionMaterial( ASobj, shoppath, now )
+        instances.append( ( objname, shopname ) )
+    return instances
+
+
+# write an appleseed object for every partition of the saved archives,
+# returns the ( objectname, shader ) and ( objectname, shoppath ) pairs
+def outputArchiveObjects( name, saved_archives, writer ):
+    instances = []
+    objects   = []
+    material_count = 0
+    for key in saved_archives:
+        objname = name +  '_%s' % material_count
+        parms   = saved_archives[ key ]
+        instances.append( ( objname, parms[2] ) )
+        objects.append( ( objname, parms[3] ) )
+        writer.begin_object( objname )
+        if len( parms[1] ) > 1:
+            writer.begin_parm( 'filename' )
+            for index, files in enumerate( parms[1] ):
+                writer.emit_parm( index, parms[0] + '/' + files )
+            writer.end_parm()
+        else:
+            writer.emit_parm( 'filename', parms[0] + '/' + parms[1][0] )
+        writer.end_object()
+        material_count += 1
+    return ( instances, objects )
+
+
+# object_index maps the soppath, and the archives written for it, to the
+# objects that were exported. Objects using the same sop or identical
+# geometry are only instanced. The archives are content addressed with
+# the archive cache, without it only the soppath is used.
+def outputGeometry( ASobj, now, writer, object_index=None, warn=True, fragment=None ):
     name = '%s-geo' % ASobj.getName()
+    sop_key = ( ASobj.soppath, ASobj.gblur )
+    if object_index is not None and object_index.has_key( sop_key ):
+        return instanceObjects( ASobj, object_index[ sop_key ], now )
+
     # saved_archives is a dict with a number as key and a list as value
-    # the list contains the path, a list with files, and shadername
+    # the list contains the path, a list with archive files, shadername
+    # and the shoppath of the partition
     saved_archives = parseGeoObject( ASobj, now, name )
 
-    # objectname : shader
-    instances = {}
+    if saved_archives and object_index is not None and theArchiveCache is not None:
+        archive_key = tuple( sorted( ( tuple( parms[1] ), parms[2] ) for parms in saved_archives.values() ) )
+        if object_index.has_key( archive_key ):
+            object_index[ sop_key ] = object_index[ archive_key ]
+            return instanceObjects( ASobj, object_index[ archive_key ], now )
+    else:
+        archive_key = None
+
     if saved_archives:
-        material_count = 0
-        for key in saved_archives:
-            objname = name +  '_%s' % material_count
-            parms   = saved_archives[ key ]
-            instances[ objname ] = parms[2]
-            writer.begin_object( objname )
-            if len( parms[1] ) > 1:
-                writer.begin_parm( 'filename' )
-                for index, files in enumerate( parms[1] ):
-                    writer.emit_parm( index, parms[0] + '/' + files + '.obj' )
-                writer.end_parm()
-            else:
-                writer.emit_parm( 'filename', parms[0] + '/' + parms[1][0] + '.obj' )
-            writer.end_object()
-            material_count += 1
+        (instances, objects) = outputArchiveObjects( name, saved_archives, writer )
+        if object_index is not None:
+            object_index[ sop_key ] = objects
+            if archive_key:
+                object_index[ archive_key ] = objects
+        if fragment is not None:
+            (path, as_archivepath) = getArchivePath( now )
+            fragment['sop_key']     = sop_key
+            fragment['archive_key'] = archive_key
+            fragment['objects']     = objects
+            fragment['files']       = [ os.path.join( as_archivepath, filename )
+                                        for parms in saved_archives.values() for filename in parms[1] ]
         return ( instances )
     else:
-        soho.warning( "No geometry returned on object: %s" % ASobj.getName() )
+        if warn:
+            soho.warning( "No geometry returned on object: %s" % ASobj.getName() )
         return False
 
 
-def outputGeometryInstance( obj, now, writer ):
+# the source of an instance is written once as an assembly holding the
+# object instances of its geometry, sources maps the key of a source to
+# the name of its assembly
+def outputSourceAssembly( key, sources, writer, output ):
+    if sources.has_key( key ):
+        return sources[ key ]
+    assem_name = 'instsource%d' % len( sources )
+    writer.begin_assembly( assem_name )
+    instances = output( assem_name )
+    for index, ( objName, shopName ) in enumerate( instances or [] ):
+        writer.begin_object_instance( '%s_%d.inst' % ( assem_name, index ), objName + ".0" )
+        writer.emit_transform()
+        emitInstanceMaterial( shopName, writer )
+        writer.end_object_instance()
+    writer.end_assembly()
+    if not instances:
+        assem_name = None
+    sources[ key ] = assem_name
+    return assem_name
+
+
+# one assembly instance per point or packed primitive, matrices are the
+# instance transforms in houdini convention. In the master assembly the
+# transform of the object is added, sub assemblies are instanced with it.
+def outputAssemblyInstances( ASobj, assemblies, matrices, now, writer, world=True ):
+    if world:
+        objxform = worldTransform( ASobj.obj, now )
+    name = '%s-inst' % ASobj.getName()
+    for index, ( assem_name, matrix ) in enumerate( zip( assemblies, matrices ) ):
+        if assem_name is None:
+            continue
+        if world:
+            matrix = ASinstance.mult4( matrix, objxform )
+        writer.begin_assembly_instance( '%s_%d' % ( name, index ), assem_name )
+        #always transpose the matrix, appleseed post multiplies matrices
+        writer.emit_transform( ASinstance.transpose4( matrix ), now )
+        writer.end_assembly_instance()
+
+
+# the object of an instance path, relative to the instancing object
+def getInstanceSource( ASobj, path, now ):
+    node = None
+    if ASobj.houobj:
+        node = ASobj.houobj.node( path )
+    if node is None:
+        node = hou.node( path )
+    if node is None:
+        soho.warning( "Instance path not found on object %s: %s" % ( ASobj.getName(), path ) )
+        return None
+    obj = soho.getObject( node.path() )
+    soppath = []
+    if not obj or not obj.evalString( 'object:soppath', now, soppath ) or not soppath[0]:
+        soho.warning( "No geometry to instance on object %s: %s" % ( ASobj.getName(), path ) )
+        return None
+    return SceneObject( obj, now, soppath[0] )
+
+
+def isPointInstancer( ASobj, now ):
+    return bool( ASobj.obj.getDefaultedString( 'instancepath', now, [''] )[0] )
+
+
+# instance objects place the object of their instance path on every point,
+# a string point attribute instancepath overrides it per point. The point
+# attributes for the transforms are fetched in one call each.
+def outputPointInstances( ASobj, now, writer, sources, world=True ):
+    instancepath = ASobj.obj.getDefaultedString( 'instancepath', now, [''] )[0]
+    ptinstance   = ASobj.obj.getDefaultedInt( 'ptinstance', now, [0] )[0]
+
+    if ptinstance and ASobj.housop:
+        geo  = ASobj.housop.geometry()
+        npts = len( geo.points() )
+        attribs = {}
+        for name in ASinstance.InstanceAttribs:
+            attrib = geo.findPointAttrib( name )
+            if attrib is not None and attrib.dataType() == hou.attribData.Float:
+                attribs[ name ] = geo.pointFloatAttribValues( name )
+        matrices = ASinstance.pointTransforms( npts, attribs )
+        attrib = geo.findPointAttrib( 'instancepath' )
+        if attrib is not None and attrib.dataType() == hou.attribData.String:
+            paths = [ path or instancepath for path in geo.pointStringAttribValues( 'instancepath' ) ]
+        else:
+            paths = [ instancepath ] * npts
+    else:
+        matrices = [ identMat ]
+        paths    = [ instancepath ]
+
+    def outputSource( path ):
+        def output( assem_name ):
+            ASsrc = getInstanceSource( ASobj, path, now )
+            if ASsrc is None:
+                return None
+            return outputGeometry( ASsrc, now, writer )
+        return output
+
+    source = {}
+    for path in set( paths ):
+        source[ path ] = outputSourceAssembly( ( 'object', path ), sources, writer, outputSource( path ) )
+    assemblies = [ source[ path ] for path in paths ]
+    outputAssemblyInstances( ASobj, assemblies, matrices, now, writer, world )
+    return len( matrices )
+
+
+# packed primitives are instances of their geometry, returns the
+# number of packed primitives written
+def outputPackedInstances( ASobj, now, writer, sources, world=True ):
+    packed = getPackedPrims( ASobj, now )
+    if not packed:
+        return 0
+
+    def outputSource( load ):
+        def output( assem_name ):
+            geo = load()
+            if geo is None:
+                return None
+            saved_archives = savePackedArchive( ASobj, geo, assem_name, now )
+            if not saved_archives:
+                return None
+            return outputArchiveObjects( assem_name + '-geo', saved_archives, writer )[0]
+        return output
+
+    assemblies = [ outputSourceAssembly( key, sources, writer, outputSource( load ) )
+                   for key, load, xform in packed ]
+    matrices   = [ xform for key, load, xform in packed ]
+    outputAssemblyInstances( ASobj, assemblies, matrices, now, writer, world )
+    return len( packed )
+
+
+# signature of everything the geometry fragment of an object depends on,
+# the sop is identified by its session id and changes are noticed by its
+# cook count. Time dependent geometry is only reused at the same time.
+# The layout of the writer is part of it, the fragment is written raw.
+# A sop that has to cook still has the cook count of its last cook, it
+# gets no signature so its geometry is fetched and cooks it.
+def geometrySignature( ASobj, now, writer ):
+    sop = ASobj.housop
+    if sop is None or sop.needsToCook( now ):
+        return None
+    signature = [ sop.sessionId(), sop.cookCount(), ASobj.houobj.sessionId(), ASobj.gblur,
+                  ASobj.obj.getDefaultedString( 'shop_materialpath', now, [''] )[0],
+                  getArchivePath( now ), sorted( ASArchiveSettings.items() ), theFloatFormat.spec,
+                  writer.get_layout() ]
+    if ASobj.xblur or ASobj.gblur or sop.isTimeDependent():
+        signature += [ now, GeoTimeSteps, VelocityBlurSamples ]
+    return repr( signature )
+
+
+# write the geometry fragment of an earlier render, the archives it
+# refers to have to be on disk still
+def outputCachedGeometry( ASobj, cached, now, writer, object_index ):
+    (text, fragment) = cached
+    for filepath in fragment['files']:
+        if not os.path.exists( filepath ):
+            return None
+    writer.emit_raw( text )
+    if object_index is not None:
+        object_index[ fragment['sop_key'] ] = fragment['objects']
+        if fragment['archive_key']:
+            object_index[ fragment['archive_key'] ] = fragment['objects']
+    return instanceObjects( ASobj, fragment['objects'], now )
+
+
+def outputGeometryInstance( obj, now, writer, object_index=None, sources=None, world=True ):
     # TODO: this function will be a place holder for
     # future procedural geometry shaders
-    instances = outputGeometry( obj, now, writer )
+    if sources is None:
+        sources = {}
+    if isPointInstancer( obj, now ):
+        outputPointInstances( obj, now, writer, sources, world )
+        return None
+
+    # unchanged geometry is not fetched again, its objects are written
+    # as they were written by an earlier render
+    cache = None
+    if ASExportSettings['as_fragmentcache']:
+        cache = ASfragment.theFragmentCache
+        key = ( 'geometry', obj.getName(), world )
+        signature = geometrySignature( obj, now, writer )
+        cached = signature and cache.lookup( key, signature )
+        if cached:
+            instances = outputCachedGeometry( obj, cached, now, writer, object_index )
+            if instances is not None:
+                return instances
+            cache.discard( key )
+
+    packed = outputPackedInstances( obj, now, writer, sources, world )
+    if cache is None or packed or not signature:
+        return outputGeometry( obj, now, writer, object_index, not packed )
+
+    fragment = {}
+    writer.begin_capture()
+    instances = outputGeometry( obj, now, writer, object_index, True, fragment )
+    text = writer.end_capture()
+    if fragment:
+        cache.store( key, signature, ( text, fragment ) )
     return instances
 
 
+# material assignment of an object instance
+def emitInstanceMaterial( shopName, writer ):
+    if shopName != None:
+        shopName = "/mat" + theMaterialMap.get( shopName, shopName )
+        writer.emit_assign_material( shopName, 'front', shopName )
+        writer.emit_assign_material( shopName, 'back' , shopName )
+    else:
+        writer.emit_comment(" No shader or material on object ")
+
+
 def outputInstances( scene, now, writer ):
     for ASobj in scene:
         instances = scene[ASobj]
-        #objName = instances[ ASobj ].keys()[0]
-        #shopName  = instances[ ASobj ].values()[0]
-
-        for geo in instances:
-            objName  = geo
-            shopName = instances[ geo ]
+        if not instances:
+            continue
 
-            instName = objName + ".inst"
+        for index, ( objName, shopName ) in enumerate( instances ):
+            instName = '%s-geo_%d.inst' % ( ASobj.getName(), index )
             writer.begin_object_instance( instName, objName + ".0" )
             instanceTransform( ASobj.obj, now, writer )
-            if shopName != None:
-                shopName = "/mat" + shopName
-                writer.emit_assign_material( shopName, 'front', shopName )
-                writer.emit_assign_material( shopName, 'back' , shopName )
-            else:
-                writer.emit_comment(" No shader or material on object ")
+            emitInstanceMaterial( shopName, writer )
             writer.end_object_instance()
 
 
@@ -1558,45 +2342,204 @@ def outputConfig( cam, now, writer ):
     writer.end_configurations()
 
 
-# here the misery really starts
-def Render( cam, now, objectlist, lightlist, writer ):
-    emitHeader( now, writer )
+# objects and lights that are the same on every frame, the objects may
+# still have motion blur from the camera
+def isStaticObject( ASobj ):
+    if ASobj.houobj is None or ASobj.gblur:
+        return False
+    return not ( ASobj.houobj.isTimeDependent() or ASobj.housop.isTimeDependent() )
 
-    writer.begin_project()
-    (cwd, paths) = getProjectPaths( now )
-    writer.emit_searchpaths( paths.values() )
-    paths['hip'] = cwd
-    writer.begin_scene()
 
-    mblur = SetCameraBlur( cam, now )
-    camName = outputCamera( cam, now, writer )
+def isStaticLight( light ):
+    node = hou.node( light.getName() )
+    return node is not None and not node.isTimeDependent()
 
-    if camName:
-        writer.begin_assembly( 'master' )
 
-        for light in lightlist:
-            outputLight( light, now, writer )
+def getStaticPath( now ):
+    path = ASExportSettings['as_staticfile']
+    if not path:
+        (cwd, paths) = getProjectPaths( now )
+        path = os.path.join( cwd, 'static.appleseed' )
+    return path
 
-        (master, subs) = groupBlurObjects( objectlist, now, mblur )
 
-        sceneObjs = {}
-        # sub assemblies
-        for index, ASobj in enumerate( subs ):
-            sub_assem_name = 'sub' + str( index )
-            sceneObjs[ sub_assem_name ] = ASobj
-            writer.begin_assembly( sub_assem_name )
-            instance = outputGeometryInstance( ASobj, now, writer )
-            outputInstances( { ASobj : instance }, now, writer )
-            writer.end_assembly()
-        instanceSubAssemblies( sceneObjs, now, writer )
+# the static project is written on the first frame of the frame range,
+# or when it is missing
+def isSequenceStart( now, staticfile ):
+    if not os.path.exists( staticfile ):
+        return True
+    rop = soho.getOutputDriver()
+    if not rop.getDefaultedInt( 'trange', now, [0] )[0]:
+        return True
+    start = rop.getDefaultedFloat( 'f', now, [0, 0, 1] )[0]
+    return abs( hou.timeToFrame( now ) - start ) < 0.001
+
+
+# project holding only the shared assembly with the static lights,
+# objects and their materials. It is written to a temporary file which
+# is renamed when complete, frames rendered at the same time never read
+# a partial project. Without replace a complete project written by
+# another frame in the meantime is kept.
+def writeStaticProject( staticfile, objects, lights, now, logger, replace=True ):
+    directory = os.path.dirname( os.path.abspath( staticfile ) )
+    (fd, tmppath) = tempfile.mkstemp( prefix='.' + os.path.basename( staticfile ), dir=directory )
+    os.close( fd )
+    try:
+        outputStaticProject( tmppath, objects, lights, now, logger )
+    except:
+        os.remove( tmppath )
+        raise
+    if not replace and os.path.exists( staticfile ):
+        os.remove( tmppath )
+    else:
+        ASarchive.replaceFile( tmppath, staticfile )
+
+
+def outputStaticProject( staticfile, objects, lights, now, logger ):
+    static_writer = AsProjectFileWriter( staticfile, logger, ASExportSettings['as_compactxml'], None,
+                                         theFloatFormat )
+    static_writer.emit_comment( "Static objects and lights shared by the frames of a sequence" )
+    static_writer.begin_project()
+    static_writer.begin_scene()
+    static_writer.begin_assembly( 'shared' )
+
+    with theProfiler.phase( 'lights' ):
+        for light in lights:
+            outputLight( light, now, static_writer )
+
+    if ASArchiveSettings['as_autoinstance']:
+        object_index = {}
+    else:
+        object_index = None
+    sceneObjs = {}
+    instance_sources = {}
+    with theProfiler.phase( 'geometry' ):
+        for ASobj in objects:
+            sceneObjs[ ASobj ] = outputGeometryInstance( ASobj, now, static_writer, object_index,
+                                                         instance_sources )
+        outputInstances( sceneObjs, now, static_writer )
+    with theProfiler.phase( 'materials' ):
+        outputMaterial( now, static_writer )
+    # the frames collect their own materials
+    clearMaterials()
+
+    static_writer.end_assembly()
+    static_writer.begin_assembly_instance( 'shared.inst', 'shared' )
+    static_writer.emit_transform()
+    static_writer.end_assembly_instance()
+    static_writer.end_scene()
+    static_writer.end_project()
+    static_writer.close_project_file()
+    theProfiler.count( 'xml bytes', static_writer.get_bytes_written() )
+
+
+# in sequence mode the static project is referenced by every frame as
+# an archive assembly
+def outputStaticAssembly( objects, lights, now, writer ):
+    staticfile = getStaticPath( now )
+    if isSequenceStart( now, staticfile ):
+        # only the first frame replaces an existing project
+        writeStaticProject( staticfile, objects, lights, now, writer.get_logger(),
+                            os.path.exists( staticfile ) )
+
+    filename = staticfile
+    if writer.get_project_dir():
+        try:
+            filename = os.path.relpath( staticfile, writer.get_project_dir() )
+        except ValueError:
+            pass
+    writer.begin_assembly( 'static', 'archive_assembly' )
+    writer.emit_parm( 'filename', filename )
+    writer.end_assembly()
+    writer.begin_assembly_instance( 'static.inst', 'static' )
+    writer.emit_transform()
+    writer.end_assembly_instance()
+
+
+# the fragment cache is kept between renders, without it the
+# fragments of earlier renders are dropped
+def beginFragments():
+    if ASExportSettings['as_fragmentcache']:
+        ASfragment.theFragmentCache.beginRender()
+    else:
+        ASfragment.theFragmentCache.clear()
+
+
+def endFragments( writer ):
+    if not ASExportSettings['as_fragmentcache']:
+        return
+    cache = ASfragment.theFragmentCache
+    cache.endRender()
+    writer.emit_comment( "Fragment cache: %d hits, %d misses" % ( cache.hits, cache.misses ) )
+
+
+# here the misery really starts
+def Render( cam, now, objectlist, lightlist, writer ):
+    with theProfiler.phase( 'rop' ):
+        emitHeader( now, writer )
+
+        writer.begin_project()
+        (cwd, paths) = getProjectPaths( now )
+        writer.emit_searchpaths( paths.values() )
+        paths['hip'] = cwd
+        writer.begin_scene()
+
+    with theProfiler.phase( 'camera' ):
+        mblur = SetCameraBlur( cam, now )
+        camName = outputCamera( cam, now, writer )
 
-        # content of the master assembly
-        sceneObjs.clear()
-        for ASobj in master:
-            sceneObjs[ ASobj ] = outputGeometryInstance( ASobj, now, writer ) 
-        outputInstances( sceneObjs, now, writer )
+    if camName:
+        with theProfiler.phase( 'grouping' ):
+            (master, subs) = groupBlurObjects( objectlist, now, mblur )
+        beginArchives( now )
+        beginFragments()
+
+        # sequence mode, the frames only hold what changes over time
+        if ASExportSettings['as_sequence']:
+            with theProfiler.phase( 'grouping' ):
+                static = [ ASobj for ASobj in master if isStaticObject( ASobj ) ]
+                master = [ ASobj for ASobj in master if not isStaticObject( ASobj ) ]
+                staticlights = [ light for light in lightlist if isStaticLight( light ) ]
+                lightlist    = [ light for light in lightlist if not isStaticLight( light ) ]
+            with theProfiler.phase( 'static' ):
+                outputStaticAssembly( static, staticlights, now, writer )
+
+        writer.begin_assembly( 'master' )
 
-        outputMaterial( now, writer )
+        with theProfiler.phase( 'lights' ):
+            for light in lightlist:
+                outputLight( light, now, writer )
+
+        with theProfiler.phase( 'geometry' ):
+            sceneObjs = {}
+            # sub assemblies
+            for index, ASobj in enumerate( subs ):
+                sub_assem_name = 'sub' + str( index )
+                sceneObjs[ sub_assem_name ] = ASobj
+                writer.begin_assembly( sub_assem_name )
+                instance = outputGeometryInstance( ASobj, now, writer, world=False )
+                outputInstances( { ASobj : instance }, now, writer )
+                writer.end_assembly()
+            instanceSubAssemblies( sceneObjs, now, writer )
+
+            # content of the master assembly, objects with the same
+            # geometry are instanced if automatic instancing is on
+            if ASArchiveSettings['as_autoinstance']:
+                object_index = {}
+            else:
+                object_index = None
+            sceneObjs.clear()
+            # assemblies of instanced objects and packed geometry
+            instance_sources = {}
+            for ASobj in master:
+                sceneObjs[ ASobj ] = outputGeometryInstance( ASobj, now, writer, object_index,
+                                                             instance_sources )
+            outputInstances( sceneObjs, now, writer )
+        endArchives( writer )
+        endFragments( writer )
+
+        with theProfiler.phase( 'materials' ):
+            outputMaterial( now, writer )
 
         writer.end_assembly()
         instanceMasterAssembly( writer )
@@ -1604,8 +2547,10 @@ def Render( cam, now, objectlist, lightlist, writer ):
         writer.end_scene()
     
         # TODO: rules for aov
-        outputOutput( cam, now, writer )
-        outputConfig( cam, now, writer )
+        with theProfiler.phase( 'output' ):
+            outputOutput( cam, now, writer )
+        with theProfiler.phase( 'config' ):
+            outputConfig( cam, now, writer )
 
         writer.end_project()
 
@@ -1628,17 +2573,139 @@ def Render( cam, now, objectlist, lightlist, writer ):
 import time
 import sys
 import os
+import errno
+import threading
+import subprocess
 
 import soho
 from soho import SohoParm
 from soho import Precision
 
 
+# seconds appleseed.cli gets to open the FIFO
+StreamOpenTimeout = 30.0
+
+
+# command line of appleseed.cli without the project file, the image is
+# shown in mplay or written to the output file
+def renderCommand():
+    cmd = [ ASExportSettings['as_clicommand'] ]
+    if ASExportSettings['as_filetype'] == 0:
+        cmd.append( '--mplay' )
+    else:
+        cmd.append( '-o' )
+        cmd.append( ASExportSettings['as_filename'] )
+    return cmd
+
+
+# the project written to appleseed.cli through a FIFO. The text written
+# is kept, when appleseed.cli exits before it read the whole project or
+# fails to render it the project is written to the file after all.
+# Closing the stream waits for the render to finish.
+class ProjectStream( object ):
+    def __init__( self, fifo, process, filename, logger ):
+        self._fifo     = fifo
+        self._process  = process
+        self._filename = filename
+        self._logger   = logger
+        self._written  = []
+        self._file     = None
+
+    def _fallBack( self, reason ):
+        self._logger.log_warning( "%s %s, writing %s\n", ASExportSettings['as_clicommand'],
+                                  reason, self._filename )
+        self._file = open( self._filename, "w" )
+        self._file.write( ''.join( self._written ) )
+        self._written = None
+
+    # False when appleseed.cli closed its end of the FIFO
+    def _send( self, send, *args ):
+        try:
+            send( *args )
+        except IOError as e:
+            if e.errno != errno.EPIPE:
+                raise
+            return False
+        return True
+
+    def write( self, txt ):
+        if self._file is not None:
+            self._file.write( txt )
+            return
+        self._written.append( txt )
+        if not self._send( self._fifo.write, txt ):
+            self._send( self._fifo.close )
+            self._fallBack( 'exited while reading the project' )
+
+    def close( self ):
+        if self._file is None and not self._send( self._fifo.close ):
+            self._fallBack( 'exited while reading the project' )
+        returncode = self._process.wait()
+        if self._file is None and returncode:
+            self._fallBack( 'failed with exit code %d' % returncode )
+        if self._file is not None:
+            self._file.close()
+
+
+# launch appleseed.cli on a FIFO and return the stream to write the project
+# to. The FIFO lives next to the project file so the relative archive paths
+# resolve the same. Returns None when FIFOs are not supported or
+# appleseed.cli did not open it.
+def openProjectStream( filename, logger ):
+    command = ASExportSettings['as_clicommand']
+    if not hasattr( os, 'mkfifo' ):
+        logger.log_warning( "Streaming is not supported on this platform, writing %s\n", filename )
+        return None
+    fifo = os.path.splitext( filename )[0] + '.stream.appleseed'
+    if os.path.exists( fifo ):
+        os.remove( fifo )
+    os.mkfifo( fifo )
+
+    try:
+        process = subprocess.Popen( renderCommand() + [ fifo ] )
+    except OSError as e:
+        os.remove( fifo )
+        logger.log_warning( "Unable to start %s: %s\n", command, e )
+        return None
+
+    # opening a FIFO blocks until appleseed.cli opens it for reading. The
+    # open waits in a thread, waiting stops when appleseed.cli exits or
+    # when it does not open the FIFO in time.
+    opened = []
+    opener = threading.Thread( target=lambda: opened.append( os.open( fifo, os.O_WRONLY ) ) )
+    opener.daemon = True
+    opener.start()
+    deadline = time.time() + StreamOpenTimeout
+    while opener.is_alive() and process.poll() is None and time.time() < deadline:
+        opener.join( 0.1 )
+    if opener.is_alive():
+        # a reader of our own lets the blocked open return
+        reader = os.open( fifo, os.O_RDONLY | os.O_NONBLOCK )
+        opener.join()
+        os.close( reader )
+        for fd in opened:
+            os.close( fd )
+        del opened[:]
+    # both ends are open, the name is not needed anymore
+    os.remove( fifo )
+
+    if not opened:
+        if process.poll() is None:
+            process.terminate()
+            logger.log_warning( "%s did not open the project in %g seconds\n", command, StreamOpenTimeout )
+        else:
+            logger.log_warning( "%s exited before reading the project\n", command )
+        process.wait()
+        return None
+    return ProjectStream( os.fdopen( opened[0], 'w' ), process, filename, logger )
+
+
 def main():
     debug_mode = False
-    logger = AsLogger( debug_mode )
+    logger = AsLogger( debug_mode, ASExportSettings['as_loglevel'], ASExportSettings['as_tracefile'] )
     logger.log_debug( "Starting appleseed export\n")
 
+    rop_start = time.time()
     parmlist = soho.evaluate({  'now'   : SohoParm('state:time', 'real',   [0],         False, key = 'now'),
                                 'camera': SohoParm('camera',     'string', '/obj/cam1', False, key = 'camera')})
 
@@ -1686,6 +2753,7 @@ def main():
 
     # Lock off the objects we've selected
     soho.lockObjects( now)
+    theProfiler.add( 'rop', time.time() - rop_start )
 
     # how fast are we?
     clockstart = time.time()
@@ -1693,37 +2761,38 @@ def main():
     rop = soho.getOutputDriver()
     filename = rop.evaluate({ 'soho_diskfile' : SohoParm( 'soho_diskfile', 'string')}, now)['soho_diskfile'].Value[0]
 
+    # with streaming appleseed.cli renders while the project is written,
+    # the project file itself is not written
+    render_mode = ASExportSettings['as_render_mode']
+    stream = None
+    if render_mode == 'stream':
+        stream = openProjectStream( filename, logger )
+        if stream is None:
+            render_mode = 'render'
+
     # initialize AsProjectFileWriter 
-    writer = AsProjectFileWriter( filename, logger )
+    writer = AsProjectFileWriter( filename, logger, ASExportSettings['as_compactxml'], stream,
+                                  theFloatFormat )
 
     Render( cam, now, soho.objectList('objlist:instance'), soho.objectList('objlist:light'), writer )
 
     # finish project file!
     writer.emit_comment( 'Script generation time %g seconds' % (time.time() - clockstart) )
+    if theProfiler.enabled:
+        theProfiler.count( 'xml bytes', writer.get_bytes_written() )
+        writer.emit_comment( 'Export profile: %s' % theProfiler.summary() )
     writer.close_project_file()
+    if theProfiler.enabled:
+        theProfiler.write( os.path.splitext( filename )[0] + '.profile.json' )
 
+    # call appleseed.cli on the written project
+    if render_mode == 'render':
+        cmd = renderCommand() + [ filename ]
+        logger.log_debug( "%s\n", ' '.join( cmd ) )
+        subprocess.Popen( cmd )
 
-    # completely untested...
-    '''
-    render_mode = soho.getDefaultedInt( 'as_render_mode', [''] )[0]
-
-    # call appleseed.cli if needed.
-    if render_mode == 0: # render & export
-        file_type = soho.getDefaultedInt( 'as_filetype', [''] )[0]
-    
-        cmd = ['appleseed.cli']
-
-        if file_type == 0: # mplay
-            cmd.append( '--mplay' )
-            cmd.append( filename )
-        else:
-            cmd.append( filename )
-            img_file_name = soho.getDefaultedString( 'as_filename', [''] )[0]
-            cmd.append( ' -o ' + img_file_name)
+    logger.close()
 
-        sys.__stdout__.write(  ' '.join( cmd ) )
-        subprocess.Popen( cmd)
-    '''
 
 #
 # call our entry point!
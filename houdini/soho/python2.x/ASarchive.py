@@ -0,0 +1,883 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+#####################################################################
+#                                                                   #
+# APPLESEED GEOMETRY ARCHIVES                                       #
+#                                                                   #
+#####################################################################
+
+#
+# NAME:         ASarchive.py ( Python )
+#
+# COMMENTS:     bulk geometry fetching and archive writers. Only the
+#               SohoGeometry interface is used, there are no hou or
+#               soho imports so it can be used outside of Houdini.
+#
+
+import os, copy, time, struct, hashlib, json, tempfile, multiprocessing
+from multiprocessing.pool import ThreadPool
+from array import array
+from itertools import chain
+
+import ASformat
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+try:
+    from itertools import izip
+except ImportError:
+    izip = zip
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+# number of points, vertices or faces formatted in one block
+_BlockSize = 4096
+
+# buffer size of the archive file handles
+_FileBuffer = 1 << 20
+
+
+# all the data of a mesh, fetched from a SohoGeometry once.
+# Vectors are stored as flat lists of floats, x y z x y z ...
+# v is only used to displace P for velocity blur (ASvelocity).
+# Without welding there is a normal per point and a uv per vertex,
+# welded meshes index the tables with Nindex (per point) and uvindex
+# (per vertex). Time samples with the same topology share nvtx, pntref
+# and uv and the sections formatted from them in shared.
+class MeshBuffer( object ):
+    def __init__( self ):
+        self.bounds    = []
+        self.npts      = 0
+        self.nprims    = 0
+        self.P         = []
+        self.v         = None
+        self.N         = []
+        self.computedN = False
+        self.uv        = None
+        self.prims     = None
+        self.nvtx      = []
+        self.pntref    = []
+        self.Nindex    = None
+        self.uvindex   = None
+        self.shared    = {}
+
+
+def _fetchPoints( geo, handle, npts ):
+    value = geo.value
+    return list( chain.from_iterable( value( handle, pt )[:3] for pt in xrange( npts ) ) )
+
+
+# primitives with less than three vertices (packed primitives, quadrics
+# and lines) can not be written as faces and are skipped. prims holds
+# the numbers of the written primitives, None if all are written.
+def _fetchFaces( geo, nprims ):
+    value = geo.value
+    vtxs  = geo.attribute( 'geo:prim', 'geo:vertexcount' )
+    nvtx  = [ value( vtxs, prim )[0] for prim in xrange( nprims ) ]
+    if not nvtx or min( nvtx ) >= 3:
+        return ( None, nvtx )
+    prims = [ prim for prim, nv in enumerate( nvtx ) if nv >= 3 ]
+    return ( prims, [ nvtx[ prim ] for prim in prims ] )
+
+
+def _faceList( mesh ):
+    if mesh.prims is None:
+        return list( enumerate( mesh.nvtx ) )
+    return list( zip( mesh.prims, mesh.nvtx ) )
+
+
+# the velocity attribute is only fetched for velocity blur
+def fetchMeshBuffer( geo, velocity=False ):
+    mesh = MeshBuffer()
+    mesh.bounds = geo.globalValue( 'geo:boundingbox' )
+    mesh.npts   = npts = geo.globalValue( 'geo:pointcount' )[0]
+
+    # point attributes
+    mesh.P = _fetchPoints( geo, geo.attribute( 'geo:point', 'P' ), npts )
+    if velocity:
+        mesh.v = _fetchPoints( geo, geo.attribute( 'geo:point', 'v' ), npts )
+    nrml = geo.attribute( 'geo:point', 'N' )
+    #if no normals, calculate the normals
+    if nrml < 0:
+        nrml = geo.normal()
+        mesh.computedN = True
+    mesh.N = _fetchPoints( geo, nrml, npts )
+
+    # primitive and vertex attributes
+    vertex = geo.vertex
+    (mesh.prims, mesh.nvtx) = _fetchFaces( geo, geo.globalValue( 'geo:primcount' )[0] )
+    mesh.nprims = len( mesh.nvtx )
+    faces  = _faceList( mesh )
+    pntRef = geo.attribute( 'geo:vertex', 'geo:pointref' )
+    mesh.pntref = [ vertex( pntRef, prim, vtx )[0] for prim, nv in faces for vtx in xrange( nv ) ]
+    uv = geo.attribute( 'geo:vertex', 'uv' )
+    if uv > 0:
+        mesh.uv = list( chain.from_iterable( vertex( uv, prim, vtx )[:3]
+                        for prim, nv in faces for vtx in xrange( nv ) ) )
+    return mesh
+
+
+# cheap check if geo has the topology of mesh: the counts, the vertex
+# count of every primitive and the first point of a sparse set of them
+def sameTopology( mesh, geo ):
+    if geo.globalValue( 'geo:pointcount' )[0] != mesh.npts:
+        return False
+    (prims, nvtx) = _fetchFaces( geo, geo.globalValue( 'geo:primcount' )[0] )
+    if prims != mesh.prims or nvtx != mesh.nvtx:
+        return False
+    pntRef = geo.attribute( 'geo:vertex', 'geo:pointref' )
+    step   = max( 1, mesh.nprims // 64 )
+    offset = 0
+    for face, ( prim, nv ) in enumerate( _faceList( mesh ) ):
+        if face % step == 0:
+            if geo.vertex( pntRef, prim, 0 )[0] != mesh.pntref[ offset ]:
+                return False
+        offset += nv
+    return True
+
+
+# fetch a time sample of mesh from geo, only P and N are read,
+# everything else is shared with mesh
+def fetchPointSample( mesh, geo ):
+    sample = copy.copy( mesh )
+    sample.bounds = geo.globalValue( 'geo:boundingbox' )
+    sample.P = _fetchPoints( geo, geo.attribute( 'geo:point', 'P' ), mesh.npts )
+    nrml = geo.attribute( 'geo:point', 'N' )
+    if nrml < 0:
+        nrml = geo.normal()
+    sample.N = _fetchPoints( geo, nrml, mesh.npts )
+    return sample
+
+
+def openArchive( filepath, binary=False ):
+    if binary:
+        return open( filepath, 'wb', _FileBuffer )
+    return open( filepath, 'w', _FileBuffer )
+
+
+# faces are written in CCW order, the first vertex stays in place and the
+# others are reversed
+def _faceOrder( offset, nv ):
+    order = [ offset ]
+    order.extend( xrange( offset + nv - 1, offset, -1 ) )
+    return order
+
+
+# point indices are 1 based, without welding the normal index equals
+# the point and the uv index equals the vertex number. base is the number
+# of vertices before the first face of mesh.
+def _writeFaces( write, mesh, base=0 ):
+    pntref  = mesh.pntref
+    nindex  = mesh.Nindex
+    uvindex = mesh.uvindex
+    hasuv   = mesh.uv is not None
+    if hasuv:
+        vfmt = ' %d/%d/%d '
+    else:
+        vfmt = ' %d//%d '
+    fmts = {}
+    offset = 0
+    for start in xrange( 0, mesh.nprims, _BlockSize ):
+        fmt  = []
+        args = []
+        for nv in mesh.nvtx[ start : start + _BlockSize ]:
+            face_fmt = fmts.get( nv )
+            if face_fmt is None:
+                face_fmt = fmts[ nv ] = 'f' + vfmt * nv + '\n'
+            fmt.append( face_fmt )
+            if nv:
+                order = _faceOrder( offset, nv )
+                for vtx in order:
+                    pt = pntref[ vtx ]
+                    if nindex:
+                        nrml = nindex[ pt ] + 1
+                    else:
+                        nrml = pt + 1
+                    if not hasuv:
+                        args.extend( ( pt + 1, nrml ) )
+                    elif uvindex:
+                        args.extend( ( pt + 1, uvindex[ vtx ] + 1, nrml ) )
+                    else:
+                        args.extend( ( pt + 1, base + vtx + 1, nrml ) )
+            offset += nv
+        write( ''.join( fmt ) % tuple( args ) )
+
+
+# format a section that does not change between time samples once. Welded
+# normals differ per sample so welded meshes are always formatted.
+def _sharedSection( mesh, name, formatter, *args ):
+    section = mesh.shared.get( name )
+    if section is None:
+        blocks = []
+        formatter( blocks.append, *args )
+        section = ''.join( blocks )
+        if mesh.Nindex is None:
+            mesh.shared[ name ] = section
+    return section
+
+
+# merge identical vectors into a table, returns the table and the table
+# index of every vector. With a tolerance vectors are compared on a grid
+# with that spacing, the first vector of a grid cell ends up in the table.
+def _weld( values, tolerance ):
+    xs = values[0::3]
+    ys = values[1::3]
+    zs = values[2::3]
+    if tolerance > 0:
+        scale = 1.0 / tolerance
+        keys = [ ( int( round( x * scale ) ), int( round( y * scale ) ), int( round( z * scale ) ) )
+                 for x, y, z in zip( xs, ys, zs ) ]
+    else:
+        keys = zip( xs, ys, zs )
+    lookup = {}
+    table  = []
+    index  = []
+    for i, key in enumerate( keys ):
+        idx = lookup.get( key )
+        if idx is None:
+            idx = lookup[ key ] = len( lookup )
+            table.extend( values[ 3 * i : 3 * i + 3 ] )
+        index.append( idx )
+    return ( table, index )
+
+
+# returns a copy of mesh with welded uvs and normals, the
+# attributes of mesh itself are left alone
+def weldMesh( mesh, tolerance=0.0 ):
+    welded = copy.copy( mesh )
+    (welded.N, welded.Nindex) = _weld( mesh.N, tolerance )
+    if mesh.uv is not None:
+        (welded.uv, welded.uvindex) = _weld( mesh.uv, tolerance )
+    return welded
+
+
+#save as a wavefront obj file, floats are written with the precision of
+#the ASformat.FloatFormat floats
+def writeObjArchive( fp, mesh, name, time_sample, floats=None ):
+    floats = floats or ASformat.theDefaultFormat
+    write = fp.write
+    write( '#archive created at %s\n' % time.ctime() )
+    write( '#name: %s\n' % name )
+    write( '# bounds: %s\n' % ' '.join( map( str, mesh.bounds ) ) )
+    write( '# time sample at: %s\n' % time_sample )
+
+    #write point positions
+    write( '\n# %d vertices\n' % mesh.npts )
+    floats.writeBlocks( write, 'v ', 3, mesh.P )
+
+    #write uv/texture coordinates
+    if mesh.uv is not None:
+        write( '\n# uv coordinates\n' )
+        write( _sharedSection( mesh, 'obj:uv:' + floats.spec, floats.writeBlocks, 'vt ', 3, mesh.uv ) )
+
+    #write normals
+    if mesh.computedN:
+        write( '\n# soho calculated normals\n' )
+    else:
+        write( '\n# normals\n' )
+    floats.writeBlocks( write, 'vn ', 3, mesh.N )
+
+    #write faces
+    write( '\n# %d faces\n' % mesh.nprims )
+    write( _sharedSection( mesh, 'obj:faces', _writeFaces, mesh ) )
+
+
+#
+# appleseed binarymesh, version 1 is the uncompressed variant of the format.
+# All values are little endian, vertices, normals and uvs are doubles.
+#
+_BinaryMeshSignature = b'BINARYMESH'
+_BinaryMeshVersion   = 1
+_NoIndex             = 0xffffffff
+
+
+def _packString( st ):
+    st = st.encode( 'utf-8' )
+    return struct.pack( '<H', len( st ) ) + st
+
+
+def _packDoubles( write, values ):
+    step = _BlockSize * 3
+    for start in xrange( 0, len( values ), step ):
+        block = values[ start : start + step ]
+        write( struct.pack( '<%dd' % len( block ), *block ) )
+
+
+# every face vertex holds a vertex, normal and uv index (0 based),
+# followed by the material index of the face. Like the obj archives
+# there are no material slots, materials are assigned on the instance.
+def _packFaces( write, mesh, base=0 ):
+    pntref  = mesh.pntref
+    nindex  = mesh.Nindex
+    uvindex = mesh.uvindex
+    hasuv   = mesh.uv is not None
+    fmts = {}
+    offset = 0
+    for start in xrange( 0, mesh.nprims, _BlockSize ):
+        fmt  = [ '<' ]
+        args = []
+        for nv in mesh.nvtx[ start : start + _BlockSize ]:
+            face_fmt = fmts.get( nv )
+            if face_fmt is None:
+                face_fmt = fmts[ nv ] = 'H%dIH' % ( nv * 3 )
+            fmt.append( face_fmt )
+            args.append( nv )
+            if nv:
+                for vtx in _faceOrder( offset, nv ):
+                    pt = pntref[ vtx ]
+                    if nindex:
+                        nrml = nindex[ pt ]
+                    else:
+                        nrml = pt
+                    if not hasuv:
+                        args.extend( ( pt, nrml, _NoIndex ) )
+                    elif uvindex:
+                        args.extend( ( pt, nrml, uvindex[ vtx ] ) )
+                    else:
+                        args.extend( ( pt, nrml, base + vtx ) )
+            args.append( 0 )
+            offset += nv
+        write( struct.pack( ''.join( fmt ), *args ) )
+
+
+#save as an appleseed binarymesh file holding a single mesh, floats
+#are stored as doubles so the precision does not apply
+def writeBinaryMeshArchive( fp, mesh, name, time_sample, floats=None ):
+    write = fp.write
+    write( _BinaryMeshSignature )
+    write( struct.pack( '<H', _BinaryMeshVersion ) )
+    # appleseed names the parts of an obj file by number,
+    # use the same name so object instances are the same
+    write( _packString( '0' ) )
+
+    #write point positions
+    write( struct.pack( '<I', mesh.npts ) )
+    _packDoubles( write, mesh.P )
+
+    #write normals
+    write( struct.pack( '<I', len( mesh.N ) // 3 ) )
+    _packDoubles( write, mesh.N )
+
+    #write uv/texture coordinates, only u and v are stored
+    if mesh.uv is not None:
+        uvs = list( mesh.uv )
+        del uvs[ 2 : : 3 ]
+        write( struct.pack( '<I', len( uvs ) // 2 ) )
+        _packDoubles( write, uvs )
+    else:
+        write( struct.pack( '<I', 0 ) )
+
+    #write material slots
+    write( struct.pack( '<H', 0 ) )
+
+    #write faces
+    write( struct.pack( '<I', mesh.nprims ) )
+    _packFaces( write, mesh )
+
+
+
+#
+# streamed archives. The mesh is read from the SohoGeometry in chunks of
+# points and primitives and every chunk is written before the next one is
+# read, so the memory used does not grow with the mesh. Indices are
+# computed from the running vertex count, streamed meshes are not welded.
+# Every section is read once while it is written and hashed on the way,
+# the key is the meshKey of the same mesh fetched in one go.
+#
+class GeometryStream( object ):
+    # velocity is the time of the sample the points are displaced to
+    # with the v attribute, None for no velocity blur
+    def __init__( self, geo, chunk, velocity=None ):
+        self.geo       = geo
+        self.chunk     = max( 1, chunk )
+        self.bounds    = geo.globalValue( 'geo:boundingbox' )
+        self.npts      = geo.globalValue( 'geo:pointcount' )[0]
+        self.primcount = geo.globalValue( 'geo:primcount' )[0]
+        self.P         = geo.attribute( 'geo:point', 'P' )
+        self.v         = None
+        self.velocity  = velocity
+        if velocity is not None:
+            self.v = geo.attribute( 'geo:point', 'v' )
+        self.N = geo.attribute( 'geo:point', 'N' )
+        self.computedN = self.N < 0
+        if self.computedN:
+            self.N = geo.normal()
+        self.uv     = geo.attribute( 'geo:vertex', 'uv' )
+        self.hasuv  = self.uv > 0
+        self.pntRef = geo.attribute( 'geo:vertex', 'geo:pointref' )
+        self.vtxs   = geo.attribute( 'geo:prim', 'geo:vertexcount' )
+        self.digest = MeshDigest()
+
+        # the counts are written before the faces
+        self.nprims    = 0
+        self.nvertices = 0
+        for faces in self._faceChunks():
+            self.nprims    += len( faces )
+            self.nvertices += sum( nv for prim, nv in faces )
+
+    def _pointChunks( self, handle ):
+        value = self.geo.value
+        for start in xrange( 0, self.npts, self.chunk ):
+            end = min( start + self.chunk, self.npts )
+            yield list( chain.from_iterable( value( handle, pt )[:3] for pt in xrange( start, end ) ) )
+
+    # ( prim, vertex count ) of the faces of a chunk of primitives,
+    # primitives with less than three vertices are skipped
+    def _faceChunks( self ):
+        value = self.geo.value
+        vtxs  = self.vtxs
+        for start in xrange( 0, self.primcount, self.chunk ):
+            end = min( start + self.chunk, self.primcount )
+            faces = [ ( prim, value( vtxs, prim )[0] ) for prim in xrange( start, end ) ]
+            yield [ face for face in faces if face[1] >= 3 ]
+
+    # the positions in chunks, displaced by the velocity if there is one
+    def _positions( self ):
+        chunks = self._pointChunks( self.P )
+        if self.v is None:
+            return chunks
+        t = self.velocity
+        return ( [ p + vel * t for p, vel in izip( P, v ) ]
+                 for P, v in izip( chunks, self._pointChunks( self.v ) ) )
+
+    def points( self ):
+        for P in self._positions():
+            self.digest.update( 'P', 'd', P )
+            yield P
+
+    # bounds of the written points like ASvelocity.velocityMeshes gives
+    # them to the buffered writer. The header is written before the
+    # points, so the displaced bounds take an extra pass over them.
+    def sampleBounds( self ):
+        if self.v is None:
+            return self.bounds
+        bounds = None
+        for P in self._positions():
+            if not P:
+                continue
+            box = [ min( P[0::3] ), min( P[1::3] ), min( P[2::3] ),
+                    max( P[0::3] ), max( P[1::3] ), max( P[2::3] ) ]
+            if bounds is None:
+                bounds = box
+            else:
+                bounds = [ min( a, b ) for a, b in zip( bounds[:3], box[:3] ) ] + \
+                         [ max( a, b ) for a, b in zip( bounds[3:], box[3:] ) ]
+        return bounds or [0.0] * 6
+
+    def normals( self ):
+        for N in self._pointChunks( self.N ):
+            self.digest.update( 'N', 'd', N )
+            yield N
+
+    def uvs( self ):
+        vertex = self.geo.vertex
+        uv     = self.uv
+        for faces in self._faceChunks():
+            values = list( chain.from_iterable( vertex( uv, prim, vtx )[:3]
+                           for prim, nv in faces for vtx in xrange( nv ) ) )
+            self.digest.update( 'uv', 'd', values )
+            yield values
+
+    # the faces of a chunk as a MeshBuffer for _writeFaces and _packFaces
+    def faces( self ):
+        vertex = self.geo.vertex
+        pntRef = self.pntRef
+        for faces in self._faceChunks():
+            chunk = MeshBuffer()
+            chunk.nvtx   = [ nv for prim, nv in faces ]
+            chunk.nprims = len( chunk.nvtx )
+            chunk.pntref = [ vertex( pntRef, prim, vtx )[0] for prim, nv in faces for vtx in xrange( nv ) ]
+            if self.hasuv:
+                chunk.uv = []
+            self.digest.update( 'nvtx',   'l', chunk.nvtx )
+            self.digest.update( 'pntref', 'l', chunk.pntref )
+            yield chunk
+
+    # only valid after every section was written
+    def key( self, extra ):
+        return self.digest.hexdigest( extra, self.npts, self.nprims, self.computedN )
+
+
+def streamObjArchive( fp, stream, name, time_sample, floats=None ):
+    floats = floats or ASformat.theDefaultFormat
+    write = fp.write
+    write( '#archive created at %s\n' % time.ctime() )
+    write( '#name: %s\n' % name )
+    write( '# bounds: %s\n' % ' '.join( map( str, stream.sampleBounds() ) ) )
+    write( '# time sample at: %s\n' % time_sample )
+
+    write( '\n# %d vertices\n' % stream.npts )
+    for P in stream.points():
+        floats.writeBlocks( write, 'v ', 3, P )
+
+    if stream.hasuv:
+        write( '\n# uv coordinates\n' )
+        for uv in stream.uvs():
+            floats.writeBlocks( write, 'vt ', 3, uv )
+
+    if stream.computedN:
+        write( '\n# soho calculated normals\n' )
+    else:
+        write( '\n# normals\n' )
+    for N in stream.normals():
+        floats.writeBlocks( write, 'vn ', 3, N )
+
+    write( '\n# %d faces\n' % stream.nprims )
+    base = 0
+    for chunk in stream.faces():
+        _writeFaces( write, chunk, base )
+        base += len( chunk.pntref )
+
+
+def streamBinaryMeshArchive( fp, stream, name, time_sample, floats=None ):
+    write = fp.write
+    write( _BinaryMeshSignature )
+    write( struct.pack( '<H', _BinaryMeshVersion ) )
+    write( _packString( '0' ) )
+
+    write( struct.pack( '<I', stream.npts ) )
+    for P in stream.points():
+        _packDoubles( write, P )
+
+    write( struct.pack( '<I', stream.npts ) )
+    for N in stream.normals():
+        _packDoubles( write, N )
+
+    if stream.hasuv:
+        write( struct.pack( '<I', stream.nvertices ) )
+        for uv in stream.uvs():
+            del uv[ 2 : : 3 ]
+            _packDoubles( write, uv )
+    else:
+        write( struct.pack( '<I', 0 ) )
+
+    write( struct.pack( '<H', 0 ) )
+
+    write( struct.pack( '<I', stream.nprims ) )
+    base = 0
+    for chunk in stream.faces():
+        _packFaces( write, chunk, base )
+        base += len( chunk.pntref )
+
+
+# returns the seconds spent and the size of the archive like writeArchive
+def streamArchive( writer, binary, stream, name, time_sample, filepath, floats=None ):
+    start = time.time()
+    with openArchive( filepath, binary ) as fp:
+        writer( fp, stream, name, time_sample, floats )
+        size = fp.tell()
+    return ( time.time() - start, size )
+
+
+#
+# content addressed archive cache. Archives are named after a hash of
+# their content, a manifest in the archive directory records the archives
+# that were written completely so other (hython) processes can reuse them.
+#
+_ManifestName = 'archives.manifest'
+
+
+# rename is atomic on posix, windows can't rename onto an existing file.
+# Temporary files are only readable by the owner, give them the default
+# permissions first so other users on the farm can read them.
+def replaceFile( src, dst ):
+    umask = os.umask( 0 )
+    os.umask( umask )
+    os.chmod( src, 0o666 & ~umask )
+    if not fcntl and os.path.exists( dst ):
+        os.remove( dst )
+    os.rename( src, dst )
+
+
+def _arrayBytes( typecode, values ):
+    data = array( typecode, values )
+    if hasattr( data, 'tobytes' ):
+        return data.tobytes()
+    return data.tostring()
+
+
+# every section of a mesh is hashed on its own, so a mesh can be hashed
+# in one go or in chunks while it is streamed and get the same key
+class MeshDigest( object ):
+    _Sections = ( 'nvtx', 'pntref', 'P', 'N', 'v', 'uv' )
+
+    def __init__( self ):
+        self.sections = {}
+
+    def update( self, section, typecode, values ):
+        if not values:
+            return
+        digest = self.sections.get( section )
+        if digest is None:
+            digest = self.sections[ section ] = hashlib.md5()
+        digest.update( _arrayBytes( typecode, values ) )
+
+    # extra holds everything besides the mesh that ends up in the
+    # archive, like the format and the material partition
+    def hexdigest( self, extra, npts, nprims, computedN ):
+        digest = hashlib.md5()
+        digest.update( repr( extra ).encode( 'utf-8' ) )
+        digest.update( struct.pack( '<3I', npts, nprims, computedN ) )
+        for section in self._Sections:
+            if section in self.sections:
+                digest.update( self.sections[ section ].digest() )
+            else:
+                digest.update( b'-' )
+        return digest.hexdigest()
+
+
+def meshKey( mesh, extra ):
+    digest = MeshDigest()
+    digest.update( 'nvtx',   'l', mesh.nvtx )
+    digest.update( 'pntref', 'l', mesh.pntref )
+    digest.update( 'P',      'd', mesh.P )
+    digest.update( 'N',      'd', mesh.N )
+    digest.update( 'v',      'd', mesh.v )
+    digest.update( 'uv',     'd', mesh.uv )
+    return digest.hexdigest( extra, mesh.npts, mesh.nprims, mesh.computedN )
+
+
+class ArchiveCache( object ):
+    def __init__( self, archivepath ):
+        self.path     = archivepath
+        self.manifest = os.path.join( archivepath, _ManifestName )
+        self.stamp    = None
+        self.entries  = self._readManifest()
+        self.added    = {}
+        self.pending  = {}
+        self.hits     = 0
+        self.misses   = 0
+
+    # mtime and size of the manifest on disk, None when there is none
+    def _manifestStamp( self ):
+        try:
+            st = os.stat( self.manifest )
+        except OSError:
+            return None
+        return ( st.st_mtime, st.st_size )
+
+    def _readManifest( self ):
+        self.stamp = self._manifestStamp()
+        try:
+            with open( self.manifest, 'r' ) as fp:
+                return json.load( fp )
+        except ( IOError, OSError, ValueError ):
+            return {}
+
+    # reads the manifest again when another process changed it since it
+    # was last read, returns whether it was read
+    def _refresh( self ):
+        if self._manifestStamp() == self.stamp:
+            return False
+        self.entries.update( self._readManifest() )
+        return True
+
+    def _isValid( self, entry ):
+        if not entry:
+            return False
+        filepath = os.path.join( self.path, entry['file'] )
+        return os.path.isfile( filepath ) and os.path.getsize( filepath ) == entry['size']
+
+    # returns the archive filename for key or None on a cache miss
+    def lookup( self, key ):
+        # being written for another partition of this frame
+        if key in self.pending:
+            self.hits += 1
+            return self.pending[ key ]['file']
+        entry = self.entries.get( key )
+        if not self._isValid( entry ):
+            # another process might have written it in the meantime
+            if self._refresh():
+                entry = self.entries.get( key )
+            if not self._isValid( entry ):
+                self.misses += 1
+                return None
+        self.hits += 1
+        return entry['file']
+
+    # an archive for key is written under the returned temporary name,
+    # commit() renames it when it is complete
+    def reserve( self, key, filename ):
+        (fd, tmppath) = tempfile.mkstemp( prefix='.' + key, dir=self.path )
+        os.close( fd )
+        self.pending[ key ] = { 'file' : filename, 'tmp' : tmppath }
+        return tmppath
+
+    def commit( self, key ):
+        pending  = self.pending.pop( key )
+        filepath = os.path.join( self.path, pending['file'] )
+        replaceFile( pending['tmp'], filepath )
+        entry = { 'file' : pending['file'], 'size' : os.path.getsize( filepath ) }
+        self.entries[ key ] = entry
+        self.added[ key ] = entry
+
+    def discard( self, key ):
+        pending = self.pending.pop( key )
+        if os.path.exists( pending['tmp'] ):
+            os.remove( pending['tmp'] )
+
+    # a streamed archive is written to a temporary file before its key is
+    # known, adopt() adds it to the cache under key. When another partition
+    # or process wrote the same archive the temporary file is removed.
+    def temporary( self ):
+        (fd, tmppath) = tempfile.mkstemp( prefix='.stream', dir=self.path )
+        os.close( fd )
+        return tmppath
+
+    def adopt( self, key, tmppath, extension ):
+        filename = self.lookup( key )
+        if filename is not None:
+            os.remove( tmppath )
+            return filename
+        filename = key + extension
+        self.pending[ key ] = { 'file' : filename, 'tmp' : tmppath }
+        self.commit( key )
+        return filename
+
+    # merge the archives written by this process into the manifest on disk,
+    # entries of archives that are no longer on disk are pruned
+    def save( self ):
+        if not self.added:
+            return
+        with open( self.manifest + '.lock', 'a' ) as lock:
+            if fcntl:
+                fcntl.flock( lock.fileno(), fcntl.LOCK_EX )
+            entries = self._readManifest()
+            entries.update( self.added )
+            for key in list( entries ):
+                if not os.path.isfile( os.path.join( self.path, entries[ key ]['file'] ) ):
+                    del entries[ key ]
+            (fd, tmppath) = tempfile.mkstemp( prefix='.manifest', dir=self.path )
+            with os.fdopen( fd, 'w' ) as fp:
+                json.dump( entries, fp, indent=0, sort_keys=True )
+            replaceFile( tmppath, self.manifest )
+            self.stamp = self._manifestStamp()
+            if fcntl:
+                fcntl.flock( lock.fileno(), fcntl.LOCK_UN )
+        self.entries = entries
+        self.added = {}
+
+
+#
+# pool of workers writing archives concurrently. Jobs hold the fetched
+# MeshBuffer, they are written by threads or by processes, the callbacks
+# run in the calling thread when the job is finished.
+#
+# returns the seconds spent and the size of the archive
+def writeArchive( writer, binary, mesh, name, time_sample, filepath, weld=None, floats=None ):
+    start = time.time()
+    if weld is not None:
+        mesh = weldMesh( mesh, weld )
+    with openArchive( filepath, binary ) as fp:
+        writer( fp, mesh, name, time_sample, floats )
+        size = fp.tell()
+    return ( time.time() - start, size )
+
+
+# formatting archives is python code holding the GIL, more threads than
+# this hardly overlap. Processes default to a process per cpu.
+DefaultThreads = 2
+
+# points and vertices of the meshes queued for the workers, the
+# traversal waits for the workers above this
+MaxQueuedVertices = 4000000
+
+
+class ArchivePool( object ):
+    def __init__( self, size=0, processes=False ):
+        if size < 1:
+            size = multiprocessing.cpu_count()
+            if not processes:
+                size = min( size, DefaultThreads )
+        self.size    = size
+        self.pool    = None
+        self.pending = []
+        self.queued  = 0
+        self.errors  = []
+        # archives written, their size and the time spent writing them
+        self.written = 0
+        self.bytes   = 0
+        self.seconds = 0.0
+        if size > 1:
+            if processes:
+                self.pool = multiprocessing.Pool( size )
+            else:
+                self.pool = ThreadPool( size )
+
+    def _finish( self, result, done, failed, filepath ):
+        try:
+            if not isinstance( result, tuple ):
+                result = result.get()
+            self.written += 1
+            self.seconds += result[0]
+            self.bytes   += result[1]
+            if done:
+                done()
+        except Exception as e:
+            self.errors.append( "Error writing archive %s: %s" % ( filepath, e ) )
+            if failed:
+                failed()
+
+    # write an archive in the calling thread, returns False when it failed
+    def run( self, function, args, filepath, done=None, failed=None ):
+        try:
+            result = function( *args )
+        except Exception as e:
+            self.errors.append( "Error writing archive %s: %s" % ( filepath, e ) )
+            if failed:
+                failed()
+            return False
+        self._finish( result, done, failed, filepath )
+        return True
+
+    def _finishFirst( self ):
+        (result, done, failed, filepath, size) = self.pending.pop( 0 )
+        self.queued -= size
+        self._finish( result, done, failed, filepath )
+
+    # queue an archive, the points and vertices of the queued meshes are
+    # bounded so the traversal can't run too far ahead of the workers
+    def submit( self, writer, binary, mesh, name, time_sample, filepath, weld=None, floats=None,
+                done=None, failed=None ):
+        args = ( writer, binary, mesh, name, time_sample, filepath, weld, floats )
+        if self.pool is None:
+            self.run( writeArchive, args, filepath, done, failed )
+            return
+        size = mesh.npts + len( mesh.pntref )
+        self.pending.append( ( self.pool.apply_async( writeArchive, args ), done, failed, filepath, size ) )
+        self.queued += size
+        while len( self.pending ) > 2 * self.size or ( self.pending and self.queued > MaxQueuedVertices ):
+            self._finishFirst()
+
+    # wait for all archives, returns the list of errors
+    def join( self ):
+        while self.pending:
+            self._finishFirst()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        errors = self.errors
+        self.errors = []
+        return errors
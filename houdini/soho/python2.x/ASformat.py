@@ -0,0 +1,90 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+#####################################################################
+#                                                                   #
+# APPLESEED NUMBER FORMATTING                                       #
+#                                                                   #
+#####################################################################
+
+#
+# NAME:         ASformat.py ( Python )
+#
+# COMMENTS:     formatting of the floats written to the project file
+#               and the obj archives. Floats get a number of significant
+#               digits without trailing zeros, with a precision of 0 the
+#               shortest text that reads back as the same double is
+#               written. No hou or soho imports.
+#
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+# 9 significant digits hold a single precision float exactly, Houdini
+# geometry is single precision
+DefaultPrecision = 9
+
+# number of vectors formatted in one block
+_BlockSize = 4096
+
+
+class FloatFormat( object ):
+    def __init__( self, precision=DefaultPrecision ):
+        self.precision = precision
+        if precision > 0:
+            self.spec = '%%.%dg' % min( precision, 17 )
+        else:
+            self.spec = '%r'
+        self._formats = {}
+
+    # format of count floats separated by spaces, between prefix and suffix
+    def vector( self, count, prefix='', suffix='' ):
+        key = ( count, prefix, suffix )
+        fmt = self._formats.get( key )
+        if fmt is None:
+            fmt = self._formats[ key ] = prefix + ' '.join( [ self.spec ] * count ) + suffix
+        return fmt
+
+    def format( self, value ):
+        return self.spec % value
+
+    # floats are formatted, ints and strings are written as they are
+    def join( self, values, sep=' ' ):
+        spec = self.spec
+        return sep.join( [ spec % value if isinstance( value, float ) else str( value )
+                           for value in values ] )
+
+    # write flat values as lines of width floats after prefix, a
+    # block of lines is formatted with a single format operation
+    def writeBlocks( self, write, prefix, width, values ):
+        fmt  = self.vector( width, prefix, '\n' )
+        step = _BlockSize * width
+        for start in xrange( 0, len( values ), step ):
+            block = values[ start : start + step ]
+            write( fmt * ( len( block ) // width ) % tuple( block ) )
+
+    # only the precision is sent to archive writer processes
+    def __getstate__( self ):
+        return ( self.precision, )
+
+    def __setstate__( self, state ):
+        self.__init__( state[0] )
+
+
+theDefaultFormat = FloatFormat()
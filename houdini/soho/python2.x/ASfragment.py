@@ -0,0 +1,73 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+#####################################################################
+#                                                                   #
+# APPLESEED FRAGMENT CACHE                                          #
+#                                                                   #
+#####################################################################
+
+#
+# NAME:         ASfragment.py ( Python )
+#
+# COMMENTS:     project fragments of entities kept between renders.
+#               SOHO runs AS.py again for every render but imported
+#               modules stay loaded for the Houdini session, so the
+#               cache lives here. No hou or soho imports.
+#
+
+
+# entries are keyed on the entity, the signature describes everything
+# the fragment depends on and has to match for the fragment to be reused
+class FragmentCache( object ):
+    def __init__( self ):
+        self._entries = {}
+        self._used    = set()
+        self.hits     = 0
+        self.misses   = 0
+
+    def beginRender( self ):
+        self._used   = set()
+        self.hits    = 0
+        self.misses  = 0
+
+    # entities that were not exported this render are dropped
+    def endRender( self ):
+        for key in list( self._entries ):
+            if key not in self._used:
+                del self._entries[ key ]
+
+    def lookup( self, key, signature ):
+        self._used.add( key )
+        entry = self._entries.get( key )
+        if entry is None or entry[0] != signature:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def store( self, key, signature, value ):
+        self._used.add( key )
+        self._entries[ key ] = ( signature, value )
+
+    def discard( self, key ):
+        self._entries.pop( key, None )
+
+    def clear( self ):
+        self._entries.clear()
+
+
+theFragmentCache = FragmentCache()
@@ -0,0 +1,173 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+#####################################################################
+#                                                                   #
+# APPLESEED INSTANCING                                              #
+#                                                                   #
+#####################################################################
+
+#
+# NAME:         ASinstance.py ( Python )
+#
+# COMMENTS:     instance transforms for point instancing and packed
+#               primitives. Matrices are lists of 16 floats in the
+#               Houdini convention (row vectors, translation in the
+#               last row). No hou or soho imports.
+#
+
+import math
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+# point attributes used for the transform of an instance
+InstanceAttribs = [ 'P', 'orient', 'N', 'up', 'v', 'pscale', 'scale', 'trans', 'pivot', 'rot', 'transform' ]
+
+_Identity3 = ( 1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0 )
+
+
+def _normalize( x, y, z ):
+    length = math.sqrt( x * x + y * y + z * z )
+    if length == 0:
+        return ( 0.0, 0.0, 0.0 )
+    return ( x / length, y / length, z / length )
+
+
+# quaternion i j k real, as the orient attribute
+def _quaternion3( q ):
+    x, y, z, w = q
+    length = math.sqrt( x * x + y * y + z * z + w * w )
+    if length == 0:
+        return _Identity3
+    x, y, z, w = x / length, y / length, z / length, w / length
+    return ( 1 - 2 * ( y * y + z * z ), 2 * ( x * y + z * w ),     2 * ( x * z - y * w ),
+             2 * ( x * y - z * w ),     1 - 2 * ( x * x + z * z ), 2 * ( y * z + x * w ),
+             2 * ( x * z + y * w ),     2 * ( y * z - x * w ),     1 - 2 * ( x * x + y * y ) )
+
+
+# rotate +z onto n, with an up vector the x axis is perpendicular to up
+def _lookat3( n, up=None ):
+    z = _normalize( *n )
+    if z == ( 0.0, 0.0, 0.0 ):
+        return _Identity3
+    if up is not None:
+        x = _normalize( up[1] * z[2] - up[2] * z[1],
+                        up[2] * z[0] - up[0] * z[2],
+                        up[0] * z[1] - up[1] * z[0] )
+        if x != ( 0.0, 0.0, 0.0 ):
+            y = ( z[1] * x[2] - z[2] * x[1],
+                  z[2] * x[0] - z[0] * x[2],
+                  z[0] * x[1] - z[1] * x[0] )
+            return x + y + z
+    # shortest rotation from +z to n
+    c = z[2]
+    if c < -0.999999:
+        return ( 1.0, 0.0, 0.0, 0.0, -1.0, 0.0, 0.0, 0.0, -1.0 )
+    vx, vy = -z[1], z[0]
+    k = 1.0 / ( 1.0 + c )
+    return ( 1 - vy * vy * k, vx * vy * k,      -vy,
+             vx * vy * k,     1 - vx * vx * k,  vx,
+             vy,              -vx,              c )
+
+
+def _mult3( a, b ):
+    return tuple( a[ r * 3 ] * b[ c ] + a[ r * 3 + 1 ] * b[ 3 + c ] + a[ r * 3 + 2 ] * b[ 6 + c ]
+                  for r in range( 3 ) for c in range( 3 ) )
+
+
+def mult4( a, b ):
+    return [ a[ r * 4 ] * b[ c ] + a[ r * 4 + 1 ] * b[ 4 + c ] +
+             a[ r * 4 + 2 ] * b[ 8 + c ] + a[ r * 4 + 3 ] * b[ 12 + c ]
+             for r in range( 4 ) for c in range( 4 ) ]
+
+
+def transpose4( m ):
+    return [ m[ c * 4 + r ] for r in range( 4 ) for c in range( 4 ) ]
+
+
+# attribs maps attribute names to flat lists of values, one tuple per
+# point. Follows the Houdini instancing rules:
+#   transform = -pivot * scale * pscale * (orient | N, up | v) * rot * (trans + P)
+# a transform attribute replaces scale, orient, N, up, v and rot.
+def pointTransforms( npts, attribs ):
+    def tuples( name, size ):
+        values = attribs.get( name )
+        if not values:
+            return None
+        return [ tuple( values[ i : i + size ] ) for i in xrange( 0, len( values ), size ) ]
+
+    P      = tuples( 'P', 3 )
+    orient = tuples( 'orient', 4 )
+    N      = tuples( 'N', 3 ) or tuples( 'v', 3 )
+    up     = tuples( 'up', 3 )
+    scale  = tuples( 'scale', 3 )
+    trans  = tuples( 'trans', 3 )
+    pivot  = tuples( 'pivot', 3 )
+    rot    = tuples( 'rot', 4 )
+    pscale = attribs.get( 'pscale' )
+    xform  = attribs.get( 'transform' )
+    xsize  = 0
+    if xform:
+        xsize = len( xform ) // max( npts, 1 )
+
+    matrices = []
+    for pt in xrange( npts ):
+        if xsize == 9:
+            m3 = tuple( xform[ pt * 9 : pt * 9 + 9 ] )
+        elif xsize == 16:
+            m = xform[ pt * 16 : pt * 16 + 16 ]
+            m3 = ( m[0], m[1], m[2], m[4], m[5], m[6], m[8], m[9], m[10] )
+        else:
+            if orient:
+                m3 = _quaternion3( orient[ pt ] )
+            elif N:
+                m3 = _lookat3( N[ pt ], up and up[ pt ] )
+            else:
+                m3 = _Identity3
+            if rot:
+                m3 = _mult3( m3, _quaternion3( rot[ pt ] ) )
+            sx = sy = sz = 1.0
+            if scale:
+                sx, sy, sz = scale[ pt ]
+            if pscale:
+                sx, sy, sz = sx * pscale[ pt ], sy * pscale[ pt ], sz * pscale[ pt ]
+            m3 = ( m3[0] * sx, m3[1] * sx, m3[2] * sx,
+                   m3[3] * sy, m3[4] * sy, m3[5] * sy,
+                   m3[6] * sz, m3[7] * sz, m3[8] * sz )
+
+        tx = ty = tz = 0.0
+        if P:
+            tx, ty, tz = P[ pt ]
+        if trans:
+            tx, ty, tz = tx + trans[ pt ][0], ty + trans[ pt ][1], tz + trans[ pt ][2]
+        if xsize == 16:
+            m = xform[ pt * 16 : pt * 16 + 16 ]
+            tx, ty, tz = tx + m[12], ty + m[13], tz + m[14]
+        if pivot:
+            px, py, pz = pivot[ pt ]
+            tx -= px * m3[0] + py * m3[3] + pz * m3[6]
+            ty -= px * m3[1] + py * m3[4] + pz * m3[7]
+            tz -= px * m3[2] + py * m3[5] + pz * m3[8]
+
+        matrices.append( [ m3[0], m3[1], m3[2], 0.0,
+                           m3[3], m3[4], m3[5], 0.0,
+                           m3[6], m3[7], m3[8], 0.0,
+                           tx,    ty,    tz,    1.0 ] )
+    return matrices
@@ -0,0 +1,93 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+#####################################################################
+#                                                                   #
+# APPLESEED EXPORT PROFILER                                         #
+#                                                                   #
+#####################################################################
+
+#
+# NAME:         ASprofile.py ( Python )
+#
+# COMMENTS:     wall clock time of the phases of an export and counters
+#               for the amount of data written. No hou or soho imports.
+#
+
+import time
+import json
+from contextlib import contextmanager
+
+
+class Profiler( object ):
+    def __init__( self, enabled=True ):
+        self.enabled  = enabled
+        self.start    = time.time()
+        self.phases   = {}
+        self.order    = []
+        self.counters = {}
+
+    # phases are reported in the order they were started
+    def _entry( self, name ):
+        entry = self.phases.get( name )
+        if entry is None:
+            entry = self.phases[ name ] = [ 0.0, 0 ]
+            self.order.append( name )
+        return entry
+
+    # phases may nest, the time of a phase includes its nested phases
+    @contextmanager
+    def phase( self, name ):
+        if not self.enabled:
+            yield
+            return
+        entry = self._entry( name )
+        start = time.time()
+        try:
+            yield
+        finally:
+            entry[0] += time.time() - start
+            entry[1] += 1
+
+    def add( self, name, seconds, calls=1 ):
+        if not self.enabled:
+            return
+        entry = self._entry( name )
+        entry[0] += seconds
+        entry[1] += calls
+
+    def count( self, name, value=1 ):
+        if self.enabled:
+            self.counters[ name ] = self.counters.get( name, 0 ) + value
+
+    def report( self ):
+        return {
+            'total'    : time.time() - self.start,
+            'phases'   : [ { 'name' : name, 'seconds' : self.phases[ name ][0], 'calls' : self.phases[ name ][1] }
+                           for name in self.order ],
+            'counters' : self.counters,
+        }
+
+    def write( self, filepath ):
+        with open( filepath, 'w' ) as fp:
+            json.dump( self.report(), fp, indent=4, sort_keys=True )
+
+    def summary( self ):
+        report = self.report()
+        text = [ "total %.3fs" % report['total'] ]
+        text.extend( "%s %.3fs" % ( phase['name'], phase['seconds'] ) for phase in report['phases'] )
+        text.extend( "%s %d" % ( name, self.counters[ name ] ) for name in sorted( self.counters ) )
+        return ', '.join( text )
@@ -0,0 +1,79 @@
+"""
+Copyright 2014 Hans Hoogenboom
+
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+
+       http://www.apache.org/licenses/LICENSE-2.0
+
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+
+#####################################################################
+#                                                                   #
+# APPLESEED VELOCITY BLUR                                           #
+#                                                                   #
+#####################################################################
+
+#
+# NAME:         ASvelocity.py ( Python )
+#
+# COMMENTS:     displaced positions and their bounds for velocity
+#               blur, every sample is written with its own bounds.
+#               Uses numpy when it is available (it ships with
+#               Houdini), otherwise plain python lists.
+#
+
+import copy
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# P and v are flat lists x y z x y z ..., samples are times relative to
+# the current frame. Returns a flat list of positions for every sample
+# and the bounds xmin ymin zmin xmax ymax zmax of every sample.
+def displacePoints( P, v, samples ):
+    if not P:
+        return ( [ [] for t in samples ], [ [0.0] * 6 for t in samples ] )
+
+    if numpy is not None:
+        pos = numpy.asarray( P, dtype=numpy.float64 )
+        vel = numpy.asarray( v, dtype=numpy.float64 )
+        times = numpy.asarray( samples, dtype=numpy.float64 ).reshape( -1, 1 )
+        moved = pos + times * vel
+        pts = moved.reshape( len( samples ), -1, 3 )
+        bounds = numpy.hstack( ( pts.min( axis=1 ), pts.max( axis=1 ) ) )
+        return ( [ sample.tolist() for sample in moved ], bounds.tolist() )
+
+    positions = []
+    bounds = []
+    for t in samples:
+        moved = [ p + vel * t for p, vel in zip( P, v ) ]
+        xs = moved[0::3]
+        ys = moved[1::3]
+        zs = moved[2::3]
+        positions.append( moved )
+        bounds.append( [ min( xs ), min( ys ), min( zs ), max( xs ), max( ys ), max( zs ) ] )
+    return ( positions, bounds )
+
+
+# one MeshBuffer per sample holding the displaced positions, the
+# other attributes are shared with mesh
+def velocityMeshes( mesh, samples ):
+    (positions, bounds) = displacePoints( mesh.P, mesh.v, samples )
+    meshes = []
+    for pos, box in zip( positions, bounds ):
+        moved = copy.copy( mesh )
+        moved.P = pos
+        moved.v = None
+        moved.bounds = box
+        meshes.append( moved )
+    return meshes